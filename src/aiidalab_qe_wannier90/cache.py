@@ -0,0 +1,123 @@
+"""Local on-disk cache for data derived from files in the AiiDA repository."""
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+from aiida import orm
+
+CACHE_DIR_ENV = 'AIIDALAB_QE_WANNIER90_CACHE'
+DEFAULT_CACHE_DIR = Path.home() / '.cache' / 'aiidalab-qe-wannier90'
+
+
+def get_cache_dir(*parts) -> Path:
+    """Return (and create) a cache directory, which can be relocated with ``$AIIDALAB_QE_WANNIER90_CACHE``.
+
+    The entries are keyed by the UUID of the node and the content of the source file, and are never
+    evicted: the cache can be deleted at any time, and is rebuilt on demand.
+    """
+    path = Path(os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR)).joinpath(*parts)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+@contextmanager
+def atomic_write(path: Path, mode='wb'):
+    """Open a temporary file next to ``path``, and move it onto ``path`` once it has been written.
+
+    Writers that run concurrently (threads, worker processes or other kernels) never share the temporary
+    file, and readers only ever see a complete file. The temporary file is removed if writing fails.
+    """
+    with tempfile.NamedTemporaryFile(mode, dir=path.parent, prefix=f'.{path.name}.', delete=False) as f:
+        try:
+            yield f
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, path)
+
+
+def get_object_key(folder: orm.FolderData, filename: str) -> str:
+    """Return a key identifying the content of ``filename``.
+
+    For stored nodes this is the key of the object in the repository, i.e. its content hash,
+    otherwise the SHA-256 of the file is computed.
+    """
+    key = folder.base.repository.get_object(filename).key
+    if key:
+        return key
+    digest = hashlib.sha256()
+    with folder.open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_nbytes(value) -> int:
+    """Return the memory used by the NumPy arrays in ``value``, which can be nested in dicts, lists and tuples."""
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sum(get_nbytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(get_nbytes(item) for item in value)
+    return 0
+
+
+class LRUCache:
+    """A thread-safe least-recently-used cache with a memory budget.
+
+    When the total size of the cached values exceeds ``max_bytes``, the least recently used
+    values are evicted. Values larger than the whole budget are not cached.
+    """
+
+    def __init__(self, max_bytes: int, sizeof=get_nbytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key][0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            self.pop(key)
+            if size > self.max_bytes:
+                return
+            self._data[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self.nbytes -= evicted_size
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            value, size = self._data.pop(key)
+            self.nbytes -= size
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)
@@ -16,7 +16,11 @@ class ConfigurationSettingsModel(ConfigurationSettingsModel, HasInputStructure):
     # to almost flat bands and do not play any role in the chemistry of the materials
     exclude_semicore = tl.Bool(allow_none=True, default_value=True)
     scan_pdwf_parameter = tl.Bool(allow_none=True, default_value=False)
+    scan_mode = tl.Unicode(allow_none=True, default_value='serial')
+    max_concurrent_wannierizations = tl.Int(allow_none=True, default_value=6)
+    scan_warm_start = tl.Bool(allow_none=True, default_value=False)
     plot_wannier_functions = tl.Bool(allow_none=True, default_value=False)
+    generate_isosurface = tl.Bool(allow_none=True, default_value=False)
     number_of_disproj_max = tl.Int(allow_none=True, default_value=15)
     number_of_disproj_min = tl.Int(allow_none=True, default_value=2)
     retrieve_hamiltonian = tl.Bool(allow_none=True, default_value=True)
@@ -41,6 +45,7 @@ class ConfigurationSettingsModel(ConfigurationSettingsModel, HasInputStructure):
         state = {
             'exclude_semicore': self.exclude_semicore,
             'plot_wannier_functions': self.plot_wannier_functions,
+            'generate_isosurface': self.generate_isosurface,
             'retrieve_hamiltonian': self.retrieve_hamiltonian,
             'retrieve_matrices': self.retrieve_matrices,
             'number_of_disproj_max': self.number_of_disproj_max,
@@ -50,6 +55,9 @@ class ConfigurationSettingsModel(ConfigurationSettingsModel, HasInputStructure):
             'energy_window_input': self.energy_window_input,
             'compute_fermi_surface': self.compute_fermi_surface,
             'scan_pdwf_parameter': self.scan_pdwf_parameter,
+            'scan_mode': self.scan_mode,
+            'max_concurrent_wannierizations': self.max_concurrent_wannierizations,
+            'scan_warm_start': self.scan_warm_start,
         }
         if self.compute_fermi_surface:
             state |= {
@@ -71,6 +79,7 @@ class ConfigurationSettingsModel(ConfigurationSettingsModel, HasInputStructure):
     def set_model_state(self, parameters: dict):
         self.exclude_semicore = parameters.get('exclude_semicore', True)
         self.plot_wannier_functions = parameters.get('plot_wannier_functions', False)
+        self.generate_isosurface = parameters.get('generate_isosurface', False)
         self.number_of_disproj_max = parameters.get('number_of_disproj_max', 15)
         self.number_of_disproj_min = parameters.get('number_of_disproj_min', 2)
         self.compute_dhva_frequencies = parameters.get('compute_dhva_frequencies', False)
@@ -80,3 +89,6 @@ class ConfigurationSettingsModel(ConfigurationSettingsModel, HasInputStructure):
         self.dhva_starting_theta = parameters.get('dHvA_frequencies_parameters', {}).get('starting_theta', 90.0)
         self.dhva_num_rotation = parameters.get('dHvA_frequencies_parameters', {}).get('num_rotation', 90)
         self.scan_pdwf_parameter = parameters.get('scan_pdwf_parameter', False)
+        self.scan_mode = parameters.get('scan_mode', 'serial')
+        self.max_concurrent_wannierizations = parameters.get('max_concurrent_wannierizations', 6)
+        self.scan_warm_start = parameters.get('scan_warm_start', False)
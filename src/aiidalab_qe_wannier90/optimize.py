@@ -0,0 +1,188 @@
+"""Helpers for the optimization of the disentanglement thresholds of the PDWF method."""
+
+import numpy as np
+from aiida import orm
+from aiida.engine import calcfunction
+
+# the Wannierization is considered good if the bands distance is below this threshold (in meV)
+BAND_DISTANCE_THRESHOLD_MEV = 10.0
+# ranges (first and last value) of the dis_proj_max and dis_proj_min scanned by the exhaustive scan
+DISPROJ_MAX_RANGE = (0.99, 0.85)
+DISPROJ_MIN_RANGE = (0.01, 0.15)
+# thresholds recommended for PDWF, preferred by the projectability analysis when it has no better choice
+DEFAULT_DISPROJ_MAX = 0.95
+DEFAULT_DISPROJ_MIN = 0.01
+
+
+def get_fermi_energy(output_parameters):
+    """Return the Fermi energy (eV) of a pw.x calculation.
+
+    With fixed occupations pw.x gives no Fermi energy, the highest occupied level is returned instead.
+
+    :param output_parameters: the ``output_parameters`` of the pw.x calculation.
+    :return: the energy, or None if the output parameters contain neither.
+    """
+    parameters = output_parameters.get_dict()
+    for key in ('fermi_energy', 'highest_occupied_level'):
+        if parameters.get(key) is not None:
+            return float(parameters[key])
+    return None
+
+
+def get_disproj_grid(number_of_disproj_max=15, number_of_disproj_min=2):
+    """Return the (dis_proj_max, dis_proj_min) points of the exhaustive scan, in the order they are tried."""
+    return [
+        (float(disproj_max), float(disproj_min))
+        for disproj_max in np.linspace(*DISPROJ_MAX_RANGE, number_of_disproj_max)
+        for disproj_min in np.linspace(*DISPROJ_MIN_RANGE, number_of_disproj_min)
+    ]
+
+
+def propose_disproj_points(trace, step_max, step_min, min_step=0.005, pending=(), max_points=None):
+    """Propose the next (dis_proj_max, dis_proj_min) points of the adaptive search.
+
+    This is a coarse-to-fine pattern search: the neighbours of the best point found so far, at a distance
+    ``step_max`` and ``step_min`` along each threshold, are proposed. Once all of them have been evaluated
+    without improving on the best point, the steps are halved, until they are smaller than ``min_step``.
+
+    :param trace: the points evaluated so far, as dicts with the thresholds (None if not set) and the
+        bands distance (None if the Wannierization failed).
+    :param pending: the (dis_proj_max, dis_proj_min) points being evaluated, that are not proposed again;
+        the steps are not halved while one of the neighbours is pending.
+    :param max_points: the maximum number of points to propose, e.g. the points of the exhaustive scan that
+        are left; none are proposed once it is zero or negative.
+    :return: the new points (empty if the search is over or waits for the pending points), and the updated
+        steps.
+    """
+    trace = [point for point in trace if None not in (point['dis_proj_max'], point['dis_proj_min'])]
+    evaluated = [(point['dis_proj_max'], point['dis_proj_min']) for point in trace]
+    pending = [tuple(point) for point in pending]
+    limit = None if max_points is None else max(0, max_points)
+    successful = [point for point in trace if point['bands_distance'] is not None]
+    if not successful:
+        # nothing to start from, start from the first point of the exhaustive scan
+        start = (DISPROJ_MAX_RANGE[0], DISPROJ_MIN_RANGE[0])
+        return ([] if start in evaluated + pending else [start])[:limit], step_max, step_min
+    best = min(successful, key=lambda point: point['bands_distance'])
+    bounds_max = sorted(DISPROJ_MAX_RANGE)
+    bounds_min = sorted(DISPROJ_MIN_RANGE)
+
+    while step_max >= min_step or step_min >= min_step:
+        candidates = []
+        if step_max >= min_step:
+            candidates += [(best['dis_proj_max'] + sign * step_max, best['dis_proj_min']) for sign in (-1, 1)]
+        if step_min >= min_step:
+            candidates += [(best['dis_proj_max'], best['dis_proj_min'] + sign * step_min) for sign in (-1, 1)]
+        points = []
+        waiting = False
+        for disproj_max, disproj_min in candidates:
+            point = (
+                round(float(np.clip(disproj_max, *bounds_max)), 4),
+                round(float(np.clip(disproj_min, *bounds_min)), 4),
+            )
+            if any(np.allclose(point, other, atol=min_step / 2) for other in evaluated + points):
+                continue
+            if any(np.allclose(point, other, atol=min_step / 2) for other in pending):
+                waiting = True
+                continue
+            points.append(point)
+        if points or waiting:
+            return points[:limit], step_max, step_min
+        step_max /= 2
+        step_min /= 2
+    return [], step_max, step_min
+
+
+def get_projectabilities(projections):
+    """Return the projectability of each state, i.e. the sum of its projections on all the orbitals.
+
+    :param projections: the ``ProjectionData`` output of a projwfc calculation.
+    :return: the (nk, nbands) projectabilities.
+    """
+    names = [name for name in projections.get_arraynames() if name.startswith('proj_')]
+    return np.sum([projections.get_array(name) for name in names], axis=0)
+
+
+def _sparsest_threshold(values, bounds, default, width):
+    """Return the threshold in ``bounds`` with the fewest ``values`` within ``width`` of it.
+
+    A threshold in a gap of the distribution is robust: shifting it slightly does not change which states
+    it selects. Ties are broken in favour of the threshold closest to ``default``.
+    """
+    lower, upper = sorted(bounds)
+    candidates = np.linspace(lower, upper, int(round((upper - lower) / (width / 2))) + 1)
+    values = np.sort(values)
+    counts = np.searchsorted(values, candidates + width) - np.searchsorted(values, candidates - width)
+    return float(candidates[np.lexsort((np.abs(candidates - default), counts))[0]])
+
+
+def predict_disproj(energies, projectabilities, fermi_energy, window=2.0, width=0.02, margin=0.01):
+    """Predict the PDWF thresholds from the projectabilities of the states, before any Wannierization.
+
+    Only the states up to ``window`` eV above the Fermi energy, i.e. those the Wannier functions have to
+    describe, are considered. ``dis_proj_max`` and ``dis_proj_min`` are put in gaps of their projectability
+    distribution, and the upper bound of the frozen window is put just below the first state above the
+    Fermi energy that is not frozen by projectability (but not below the Fermi energy).
+
+    :param energies: the (nk, nbands) energies of the states (eV).
+    :param projectabilities: the (nk, nbands) projectabilities of the states.
+    :return: a dict with the predicted ``dis_proj_max``, ``dis_proj_min`` and ``dis_froz_max``.
+    """
+    energies = np.ravel(energies)
+    projectabilities = np.ravel(projectabilities)
+    relevant = energies <= fermi_energy + window
+    disproj_max = _sparsest_threshold(projectabilities[relevant], DISPROJ_MAX_RANGE, DEFAULT_DISPROJ_MAX, width)
+    disproj_min = _sparsest_threshold(projectabilities[relevant], DISPROJ_MIN_RANGE, DEFAULT_DISPROJ_MIN, width)
+    unfrozen = relevant & (energies > fermi_energy) & (projectabilities < disproj_max)
+    onset = energies[unfrozen].min() if unfrozen.any() else fermi_energy + window
+    return {
+        'dis_proj_max': round(disproj_max, 4),
+        'dis_proj_min': round(disproj_min, 4),
+        'dis_froz_max': float(max(onset - margin, fermi_energy)),
+    }
+
+
+@calcfunction
+def analyse_projectability(projections, fermi_energy):
+    """Predict the PDWF thresholds from the projections computed by projwfc, see ``predict_disproj``."""
+    energies = projections.get_reference_bandsdata().get_bands()
+    return orm.Dict(predict_disproj(energies, get_projectabilities(projections), fermi_energy.value))
+
+
+@calcfunction
+def compute_bands_distance(reference_bands, interpolated_bands, fermi_energy, parameters):
+    """Compute the bands distance (eV) of a Wannier90 calculation with respect to the DFT bands.
+
+    The distance is the one of the ``Wannier90OptimizeWorkChain``, at 2 eV above the Fermi energy.
+
+    :param parameters: the input parameters of the Wannier90 calculation, for the excluded bands.
+    """
+    from aiida_wannier90_workflows.workflows.optimize import get_bands_distance_ef2
+
+    return orm.Float(get_bands_distance_ef2(
+        reference_bands,
+        interpolated_bands,
+        fermi_energy=fermi_energy.value,
+        exclude_list_dft=parameters.get_dict().get('exclude_bands'),
+    ))
+
+
+@calcfunction
+def build_optimize_trace(**kwargs):
+    """Collect the points tried by the scan of the thresholds, in order, with their bands distance.
+
+    For the point ``i``, ``parameters_i`` are the input parameters of its Wannier90 calculation, ``info_i``
+    the other entries of the point (PK, number of iterations...) and ``bands_distance_i`` its bands distance,
+    not given if the Wannierization failed.
+    """
+    trace = []
+    for index in range(len([key for key in kwargs if key.startswith('info_')])):
+        parameters = kwargs[f'parameters_{index}'].get_dict()
+        distance = kwargs.get(f'bands_distance_{index}')
+        trace.append({
+            'dis_proj_max': parameters.get('dis_proj_max'),
+            'dis_proj_min': parameters.get('dis_proj_min'),
+            'bands_distance': distance.value if distance is not None else None,
+            **kwargs[f'info_{index}'].get_dict(),
+        })
+    return orm.List(list=trace)
@@ -3,6 +3,11 @@ from aiida.common.extendeddicts import AttributeDict
 import traitlets as tl
 from aiida import orm
 
+from ..tight_binding import load_tb_model
+from ..utils import analyse_wannier_functions, get_wout_series
+from .querylog import log_queries
+from .summary import load_summary, store_summary
+
 class Wannier90ResultsModel(ResultsModel):
     title = 'Wannier functions'
     identifier = 'wannier90'
@@ -14,39 +19,134 @@ class Wannier90ResultsModel(ResultsModel):
     im_re_ratio = tl.List(allow_none=True)
     wannier90_outputs = tl.Dict(allow_none=True)
     retrieved = tl.Instance(orm.FolderData, allow_none=True)
+    isosurfaces = tl.Dict(allow_none=True)
+    # memory budgets (in bytes) of the caches of parsed grids and of isosurface meshes
+    grid_cache_bytes = tl.Int(512 * 1024**2)
+    mesh_cache_bytes = tl.Int(256 * 1024**2)
+    # length (Å) of the longest R vectors kept in the tight-binding model, all of them if None
+    tb_max_radius = tl.Float(None, allow_none=True)
 
     _this_process_label = 'QeAppWannier90BandsWorkChain'
 
+    _outputs = None
+    _summary = None
+    _tight_binding = None
+    _tight_binding_radius = None
+
+    def fetch_outputs(self) -> AttributeDict:
+        """Fetch all the outputs in the ``wannier90`` namespace of the root workchain with a single query.
+
+        The nodes are loaded together with their attributes and repository metadata, so that reading
+        output parameters or opening retrieved files does not need further queries.
+        The outputs are nested by namespace, as in ``root.outputs.wannier90``, and are cached.
+        """
+        if self._outputs is None:
+            root = self.fetch_process_node()
+            qb = orm.QueryBuilder()
+            qb.append(orm.WorkflowNode, filters={'id': root.pk}, tag='root')
+            qb.append(
+                orm.Data,
+                with_incoming='root',
+                edge_filters={'label': {'like': 'wannier90__%'}},
+                edge_project='label',
+                edge_tag='link',
+                project='*',
+                tag='data',
+            )
+            outputs = AttributeDict()
+            for row in qb.dict():
+                # ``_`` is a wildcard in the filter above
+                if not row['link']['label'].startswith('wannier90__'):
+                    continue
+                *namespaces, name = row['link']['label'].split('__')[1:]
+                namespace = outputs
+                for key in namespaces:
+                    namespace = namespace.setdefault(key, AttributeDict())
+                namespace[name] = row['data']['*']
+            self._outputs = outputs
+        return self._outputs
+
+    @log_queries('Wannier90ResultsModel.fetch_result')
     def fetch_result(self):
-        root = self.fetch_process_node()
-        self.structure = root.outputs.wannier90.pw_bands.primitive_structure
-        self.bands_distance = root.outputs.wannier90.wannier90_bands.bands_distance.value
-        data = root.outputs.wannier90.wannier90_bands.wannier90_optimal.output_parameters.get_dict()
-        self.wannier90_outputs = {key: data[key] for key in ['number_wfs', 'Omega_D', 'Omega_I', 'Omega_OD']}
+        outputs = self.fetch_outputs()
+        self.structure = outputs.pw_bands.primitive_structure
+        summary = self.get_summary()
+        self.bands_distance = summary['bands_distance']
+        self.wannier90_outputs = summary['wannier90_outputs']
         # Wannier centers/spreads
-        self.wannier_centers_spreads = self.get_wannier_centers_spreads(root)
-        self.omega_is, self.omega_tots = self.get_omega(root)
-        if 'wannier90_plot' in root.outputs.wannier90.wannier90_bands:
-            self.retrieved = root.outputs.wannier90.wannier90_bands.wannier90_plot.retrieved
+        self.wannier_centers_spreads = summary['wannier_centers_spreads']
+        self.omega_is, self.omega_tots = summary['omega_is'], summary['omega_tots']
+        if 'wannier90_plot' in outputs.wannier90_bands:
+            self.retrieved = outputs.wannier90_bands.wannier90_plot.retrieved
         else:
-            self.retrieved = root.outputs.wannier90.wannier90_bands.wannier90_optimal.retrieved
-
-    def get_omega(self, root):
-        omega_is = []
-        omega_tots = []
-        with root.outputs.wannier90.wannier90_bands.wannier90_optimal.retrieved.open('aiida.wout') as f:
-            lines = f.readlines()
-            for line in lines:
-                if '  <-- DIS' in line:
-                    omega_i = float(line.split()[2])
-                    omega_is.append(omega_i)
-                if '<-- SPRD' in line:
-                    omega_tot = float(line.split('O_TOT=')[1].split('<-- SPRD')[0])
-                    omega_tots.append(omega_tot)
-        return omega_is, omega_tots
-
-    def get_wannier_centers_spreads(self, node):
-        outputs = node.outputs.wannier90.wannier90_bands.wannier90_optimal.output_parameters.get_dict()
+            self.retrieved = outputs.wannier90_bands.wannier90_optimal.retrieved
+        # Isosurfaces precomputed by the workchain
+        self.isosurfaces = dict(outputs.get('generate_isosurface', {}))
+
+    def get_tight_binding_model(self) -> dict:
+        """Return the tight-binding model parsed from the retrieved ``_tb.dat`` file, or None if there is none.
+
+        Only the shells of R vectors up to ``tb_max_radius`` are read from the cache.
+        """
+        if self._tight_binding is None or self._tight_binding_radius != self.tb_max_radius:
+            filename = next((name for name in self.retrieved.list_object_names() if name.endswith('_tb.dat')), None)
+            if filename is None:
+                return None
+            self._tight_binding = load_tb_model(self.retrieved, filename, max_radius=self.tb_max_radius)
+            self._tight_binding_radius = self.tb_max_radius
+        return self._tight_binding
+
+    def get_dft_fermi_energy(self):
+        """Return the Fermi energy (eV) of the DFT band structure calculation, or None if not available."""
+        band_parameters = self.fetch_outputs().pw_bands.get('band_parameters')
+        if band_parameters is None:
+            return None
+        return band_parameters.get_dict().get('fermi_energy')
+
+    def get_retrieved_folders(self) -> dict:
+        """Return the folders retrieved by the Wannier90 calculations, as a dictionary {label: FolderData}."""
+        wannier90_bands = self.fetch_outputs().wannier90_bands
+        return {
+            label: wannier90_bands[label].retrieved
+            for label in ('wannier90_optimal', 'wannier90_plot')
+            if label in wannier90_bands
+        }
+
+    def get_summary(self) -> dict:
+        """Return the summary of the results, stored in the extras of the workchain node.
+
+        The summary is built from the raw outputs the first time, or when its version changed,
+        and is only stored once the workchain finished successfully.
+        """
+        if self._summary is None:
+            node = self.fetch_child_process_node()
+            summary = load_summary(node) if node is not None else None
+            if summary is None:
+                summary = self.build_summary()
+                if node is not None and node.is_finished_ok:
+                    summary = store_summary(node, summary)
+            self._summary = summary
+        return self._summary
+
+    def build_summary(self) -> dict:
+        outputs = self.fetch_outputs()
+        data = outputs.wannier90_bands.wannier90_optimal.output_parameters.get_dict()
+        omega_is, omega_tots = self.get_omega(outputs)
+        return {
+            'bands_distance': outputs.wannier90_bands.bands_distance.value,
+            'wannier90_outputs': {key: data[key] for key in ['number_wfs', 'Omega_D', 'Omega_I', 'Omega_OD']},
+            'wannier_centers_spreads': self.get_wannier_centers_spreads(outputs),
+            'omega_is': omega_is,
+            'omega_tots': omega_tots,
+            'skeaf': self.build_skeaf(outputs),
+        }
+
+    def get_omega(self, outputs):
+        series = get_wout_series(outputs.wannier90_bands.wannier90_optimal.retrieved)
+        return series['omega_i'].tolist(), series['omega_tot'].tolist()
+
+    def get_wannier_centers_spreads(self, wannier90_outputs):
+        outputs = wannier90_outputs.wannier90_bands.wannier90_optimal.output_parameters.get_dict()
         columns = [
             {'field': 'id', 'headerName': 'WF', 'editable': False},
             {'field': 'spreads_initial', 'headerName': 'Initial spread (first iteration) (Å2)', 'editable': False, 'width': 130,},
@@ -54,8 +154,8 @@ class Wannier90ResultsModel(ResultsModel):
             {'field': 'centers_final', 'headerName': 'Centers final (Å)', 'editable': False, 'width': 180,},
             {'field': 'centers_initial', 'headerName': 'Centers initial (Å)', 'editable': False, 'width': 180,},
         ]
-        if 'wannier90_plot' in node.outputs.wannier90.wannier90_bands:
-            plot_parameters = node.outputs.wannier90.wannier90_bands.wannier90_plot.output_parameters.get_dict()
+        if 'wannier90_plot' in wannier90_outputs.wannier90_bands:
+            plot_parameters = wannier90_outputs.wannier90_bands.wannier90_plot.output_parameters.get_dict()
             columns.append({'field': 'im_re_ratio', 'headerName': 'Im_re_ratio', 'editable': False})
         else:
             plot_parameters = None
@@ -76,8 +176,53 @@ class Wannier90ResultsModel(ResultsModel):
 
         return centers_spreads
 
+    def get_wannier_function_analytics(self) -> dict:
+        """Return the real-space diagnostics of the Wannier functions, see ``analyse_wannier_functions``.
+
+        They read all the XSF files, so they are only computed the first time they are needed, and are then
+        cached in the summary. The first call can take long, the results panel makes it in a background thread.
+        """
+        summary = self.get_summary()
+        if 'wannier_function_analytics' not in summary:
+            wannier90_bands = self.fetch_outputs().wannier90_bands
+            analytics = {}
+            if 'wannier90_plot' in wannier90_bands:
+                analytics = analyse_wannier_functions(wannier90_bands.wannier90_plot.retrieved)
+            summary['wannier_function_analytics'] = analytics
+            node = self.fetch_child_process_node()
+            if node is not None and node.is_finished_ok:
+                self._summary = store_summary(node, summary)
+        return self._summary['wannier_function_analytics']
+
+    def fetch_wannier_function_analytics(self):
+        """Add the real-space diagnostics of the Wannier functions to the table of centers and spreads."""
+        columns = self.wannier_centers_spreads['columns']
+        if any(column['field'] == 'norm' for column in columns):
+            return
+        analytics = self.get_wannier_function_analytics()
+        if not analytics:
+            return
+        columns = [
+            *columns,
+            {'field': 'norm', 'headerName': 'Norm', 'editable': False},
+            {'field': 'density_center', 'headerName': 'Center of |ψ|² (Å)', 'editable': False, 'width': 180,},
+            {'field': 'second_moment', 'headerName': 'Second moment of |ψ|² (Å2)', 'editable': False, 'width': 130,},
+            {'field': 'sign_balance', 'headerName': 'Sign balance', 'editable': False},
+        ]
+        rows = []
+        for row in self.wannier_centers_spreads['data']:
+            row = dict(row)
+            wannier_function = analytics.get(f'aiida_{row["id"]:05d}.xsf')
+            if wannier_function:
+                row['norm'] = round(wannier_function['norm'], 4)
+                row['density_center'] = '[' + ', '.join(f'{x:.4f}' for x in wannier_function['centre']) + ']'
+                row['second_moment'] = round(wannier_function['second_moment'], 3)
+                row['sign_balance'] = round(wannier_function['sign_balance'], 3)
+            rows.append(row)
+        self.wannier_centers_spreads = {'columns': columns, 'data': rows}
+
     def get_bands_node(self):
-        outputs = self._get_child_outputs()
+        outputs = self.fetch_outputs()
         pw_bands = outputs.pw_bands
         wannier90_bands = AttributeDict()
         for key in pw_bands.keys():
@@ -86,11 +231,14 @@ class Wannier90ResultsModel(ResultsModel):
         return pw_bands, wannier90_bands
 
     def get_skeaf(self) -> dict:
-        outputs = self._get_child_outputs()
+        """Return the dHvA frequencies as a dictionary {band: {'phi', 'theta', 'freq'}}, or None."""
+        return self.get_summary()['skeaf']
+
+    def build_skeaf(self, outputs) -> dict:
         if 'skeaf' not in outputs:
             return None
         skeaf_results = {}
         for band in outputs.skeaf.skeaf:
             frequency = outputs.skeaf.skeaf[band].frequency
-            skeaf_results[band] = frequency
+            skeaf_results[band] = {name: frequency.get_array(name).tolist() for name in ('phi', 'theta', 'freq')}
         return skeaf_results
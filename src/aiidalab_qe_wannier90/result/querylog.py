@@ -0,0 +1,43 @@
+"""Log the number of database queries, and the time, spent in a block of code."""
+
+import logging
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+
+def _get_engine():
+    from aiida.manage import get_manager
+
+    storage = get_manager().get_profile_storage()
+    if not hasattr(storage, 'get_session'):
+        return None
+    return storage.get_session().get_bind()
+
+
+@contextmanager
+def log_queries(label: str):
+    """Log how many SQL statements are executed, and how long it takes, within the block.
+
+    It can also be used as a decorator. Statements executed by other threads in the meantime are counted too.
+    """
+    engine = _get_engine()
+    count = 0
+
+    def _count(*args, **kwargs):
+        nonlocal count
+        count += 1
+
+    if engine is not None:
+        event.listen(engine, 'before_cursor_execute', _count)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if engine is not None:
+            event.remove(engine, 'before_cursor_execute', _count)
+        logger.info('%s: %d queries in %.3f s', label, count, elapsed)
@@ -4,18 +4,60 @@ from aiidalab_qe.common.bands_pdos import BandsPdosModel, BandsPdosWidget
 from aiidalab_qe.common.panel import ResultsPanel
 import ipywidgets as ipw
 from .model import Wannier90ResultsModel
-from .utils import create_download_link, plot_skeaf
+from .querylog import log_queries
+from .utils import (
+    BUNDLE_FILE_GROUPS,
+    BrowserDownload,
+    create_download_link,
+    list_bundle_files,
+    plot_skeaf,
+    write_bundle,
+)
 from table_widget import TableWidget
 import plotly.graph_objs as go
 import plotly.express as px
 from weas_widget import WeasWidget
+from tornado.ioloop import IOLoop
 import ast
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import numpy as np
-from ..utils import process_xsf_file
+from ..cache import LRUCache
+from ..optimize import BAND_DISTANCE_THRESHOLD_MEV
+from ..tight_binding import compute_dos, fermi_level, interpolate_bandpath
+from ..utils import (
+    compute_wannier_function_mesh,
+    encode_mesh,
+    fraction_from_isovalue,
+    isovalue_from_fraction,
+    lattice_translations,
+    load_isosurface_mesh,
+    load_wannier_function_grid,
+    tile_mesh,
+    weld_mesh,
+)
+
+logger = logging.getLogger(__name__)
 
 # Define a threshold for considering atoms "almost equally distant"
 DISTANCE_THRESHOLD = 0.01
-BAND_DISTANCE_WARNING_MEV = 10.0  # show warning if distance exceeds this threshold (in meV)
+
+# Level of detail of the isosurfaces: while the isovalue slider moves, a coarse mesh is shown, and it is
+# refined to full resolution once the slider has not moved for REFINE_DELAY seconds
+COARSE_STEP_SIZE = 3
+REFINE_DELAY = 0.4
+# Worker processes computing the positive and negative lobes in parallel, threads prefetching the
+# Wannier functions in the background, and threads running the longer computations started from the panel
+MESH_WORKERS = 2
+PREFETCH_WORKERS = 1
+TASK_WORKERS = 2
+# Number of Wannier functions prefetched around the selected one, so that they do not evict each other
+# from the caches
+PREFETCH_WINDOW = 4
+# Number of grid planes per slab in marching cubes, to bound the memory used for large grids
+ISOSURFACE_BLOCK_SIZE = 64
 
 ISOSURFACE_COLOR = {
     'positive': [1.0, 1.0, 0.0, 0.8],
@@ -24,24 +66,14 @@ ISOSURFACE_COLOR = {
 
 class Wannier90ResultsPanel(ResultsPanel[Wannier90ResultsModel]):
 
+    @log_queries('Wannier90ResultsPanel._render')
     def _render(self):
-        """Render the Wannier90 results panel."""
-        self._model.fetch_result()
-
-        # Retrieve band structures
-        pw_bands, wannier90_bands = self._model.get_bands_node()
-        wannier90_bands['trace_settings'] = {'dash': 'dash',
-                                             'shape': 'linear',
-                                             'color': 'red'}
-        model = BandsPdosModel(
-            bands=pw_bands,
-            external_bands={'Wannier-interpolated bands': wannier90_bands},
-            plot_settings={'bands_trace_settings': {'name': 'DFT bands'}},
-        )
+        """Render the Wannier90 results panel.
 
-        # Create and render the bands/PDOS widget
-        bands_widget = BandsPdosWidget(model=model)
-        bands_widget.render()
+        Only the summary of the Wannierization is built immediately; the other sections are
+        built the first time they are expanded (see ``_on_section_select``).
+        """
+        self._model.fetch_result()
 
         # Wannier90 outputs summary (merged with bands distance)
         wannier90_outputs = self._model.wannier90_outputs
@@ -85,7 +117,7 @@ class Wannier90ResultsPanel(ResultsPanel[Wannier90ResultsModel]):
             """
         )
         show_bands_distance_warning = False
-        if bands_distance_mev > BAND_DISTANCE_WARNING_MEV:
+        if bands_distance_mev > BAND_DISTANCE_THRESHOLD_MEV:
             show_bands_distance_warning = True
             bands_distance_warning_widget.value = f"""
             <div style="
@@ -107,6 +139,88 @@ class Wannier90ResultsPanel(ResultsPanel[Wannier90ResultsModel]):
             </div>
             """
 
+        # Isosurface: parsed grids and meshes are kept in two separate LRU caches, so that changing
+        # the isovalue only recomputes the meshes
+        self._grid_cache = LRUCache(max_bytes=self._model.grid_cache_bytes)
+        self._mesh_cache = LRUCache(max_bytes=self._model.mesh_cache_bytes)
+        self._isovalues = {}
+        self._syncing_isovalue = False
+        self._refine_timer = None
+        self._requested_isovalue = None
+        self._plot_lock = threading.Lock()
+        self._grid_locks = {}
+        self._grid_locks_guard = threading.Lock()
+        # widgets are only updated in the thread of the kernel, the background threads schedule their updates
+        self._io_loop = IOLoop.current()
+        self._executor_lock = threading.Lock()
+        self._closed = False
+        self._mesh_executor = None
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS)
+        self._prefetch_futures = []
+        self._task_executor = ThreadPoolExecutor(max_workers=TASK_WORKERS)
+        self.wannier90_plot_retrieved = self._model.retrieved
+        self._xsf_filenames = set(self.wannier90_plot_retrieved.list_object_names())
+
+        # Sections, built on first expansion
+        self._sections = [
+            ('DFT and Wannier-interpolated electronic band structure', self._build_bands_section),
+            ('Convergence of the spreads', self._build_convergence_section),
+            ('Wannier functions', self._build_wannier_functions_section),
+        ]
+        if any(filename.endswith('_tb.dat') for filename in self._xsf_filenames):
+            self._sections.append(('Tight-binding interpolation', self._build_tight_binding_section))
+        if self._model.get_skeaf() is not None:
+            self._sections.append(('Fermi surface', self._build_skeaf_section))
+        self._sections.append(('Download files', self._build_downloads_section))
+        self.sections = ipw.Accordion(children=[ipw.VBox() for _ in self._sections], selected_index=None)
+        for i, (title, _) in enumerate(self._sections):
+            self.sections.set_title(i, title)
+        self.sections.observe(self._on_section_select, names='selected_index')
+
+        # Arrange components in the panel
+        self.children = [
+            ipw.VBox([
+                ipw.HTML('<h2>Wannierization details</h2>'),
+                wannier90_outputs_parameters,
+                bands_distance_warning_widget if show_bands_distance_warning else ipw.HTML(''),
+            ]),
+            self.sections,
+        ]
+
+    def _on_section_select(self, change):
+        """Build a section the first time it is expanded."""
+        index = change['new']
+        if index is None:
+            return
+        container = self.sections.children[index]
+        if not container.children:
+            title, build = self._sections[index]
+            container.children = [ipw.HTML('Loading...')]
+            try:
+                container.children = build()
+            except Exception as e:
+                logger.exception('Could not build the section %r', title)
+                container.children = [ipw.HTML(f'<span style="color: red;">Could not load this section: {e}</span>')]
+
+    def _build_bands_section(self):
+        # Retrieve band structures
+        pw_bands, wannier90_bands = self._model.get_bands_node()
+        wannier90_bands['trace_settings'] = {'dash': 'dash',
+                                             'shape': 'linear',
+                                             'color': 'red'}
+        model = BandsPdosModel(
+            bands=pw_bands,
+            external_bands={'Wannier-interpolated bands': wannier90_bands},
+            plot_settings={'bands_trace_settings': {'name': 'DFT bands'}},
+        )
+
+        # Create and render the bands/PDOS widget
+        bands_widget = BandsPdosWidget(model=model)
+        bands_widget.render()
+
+        return [bands_widget]
+
+    def _build_convergence_section(self):
         # Omega convergence plots
         omega_is = self._model.omega_is
         fig = px.line(
@@ -126,6 +240,9 @@ class Wannier90ResultsPanel(ResultsPanel[Wannier90ResultsModel]):
         fig.update_xaxes(title='Number of iterations')
         self.plot_omega_tots = go.FigureWidget(fig)
 
+        return [ipw.HBox([self.plot_omega_is, self.plot_omega_tots])]
+
+    def _build_wannier_functions_section(self):
         # Structure
         self.structure_viewer = WeasWidget()
         atoms = self._model.structure.get_ase()
@@ -139,29 +256,38 @@ class Wannier90ResultsPanel(ResultsPanel[Wannier90ResultsModel]):
             max=1.0,
             step=0.01,
             description='Isovalue:',
-            continuous_update=False,
+            continuous_update=True,
+            readout_format='.3g',
         )
         self.isovalue.observe(self._on_isovalue_change, names='value')
+        # Alternative control: the isovalue whose isosurface encloses a given fraction of |ψ|²
+        self.enclosed_fraction = ipw.FloatSlider(
+            value=0.5,
+            min=0.01,
+            max=0.99,
+            step=0.01,
+            description='Enclosed |ψ|²:',
+            continuous_update=True,
+            readout_format='.0%',
+            style={'description_width': 'initial'},
+        )
+        self.enclosed_fraction.observe(self._on_enclosed_fraction_change, names='value')
         self.switch_supercell = ipw.Checkbox(
             value=False,
             description='Show supercell',
         )
         self.switch_supercell.observe(self._on_switch_supercell_change, names='value')
-        self.root_process_node = self._model.fetch_process_node()
-        self.wannier90_plot_retrieved = self.root_process_node.outputs.wannier90.wannier90_bands.wannier90_plot.retrieved
-        filename = f'aiida_{int(1):05d}.xsf'
-        self.download_xsf = ipw.HTML('No wannier function are selected for download.')
-        # Isosurface
-        self.isosurface_data = {}
+        self.download_xsf = ipw.VBox([ipw.HTML('No wannier function are selected for download.')])
         structure_viewer_section = ipw.VBox([
             ipw.HTML('<h3>Wannier functions in real space</h3>'),
             self.isovalue,
+            self.enclosed_fraction,
             self.switch_supercell,
             self.download_xsf,
             self.structure_viewer,
         ], layout=ipw.Layout(width='80%', margin='10px 0'))
 
-        # Wannier centers and spreads table
+        # Wannier centers and spreads table, the diagnostics computed from the XSF files are added once ready
         self.table = TableWidget(style={'margin-top': '10px'})
         self.table.from_data(
             self._model.wannier_centers_spreads['data'],
@@ -171,26 +297,174 @@ class Wannier90ResultsPanel(ResultsPanel[Wannier90ResultsModel]):
         self.table_description = ipw.HTML(
             'Click on a table row to visualize on the bottom the corresponding Wannier function in real space.'
         )
+        self.analytics_message = ipw.HTML('Computing the real-space diagnostics of the Wannier functions...')
         table_section = ipw.VBox([
-            ipw.HTML('<h3>Wannier centers and spreads</h3>'),
             self.table_description,
-            self.table
+            self.table,
+            self.analytics_message,
         ])
+        future = self._task_executor.submit(self._model.get_wannier_function_analytics)
+        future.add_done_callback(lambda f: self._io_loop.add_callback(self._on_wannier_function_analytics, f))
 
-        self.skeaf_container = ipw.VBox([
-            ipw.HTML('<h2>Fermi surface</h2>'),
-            ipw.HTML('<h3>de Haas van Alphen (dHva) frequencies</h3>'),
-        ])
+        self._prefetch_wannier_functions()
+        return [table_section, structure_viewer_section]
+
+    def _on_wannier_function_analytics(self, future):
+        """Add the diagnostics computed in the background to the table, in the thread of the kernel."""
+        if self._closed:
+            return
+        try:
+            future.result()
+        except Exception as e:
+            logger.warning('Could not analyse the Wannier functions: %s', e)
+            self.analytics_message.value = (
+                f'<span style="color: red;">Could not compute the real-space diagnostics: {e}</span>'
+            )
+            return
+        self.analytics_message.value = ''
+        self._model.fetch_wannier_function_analytics()
+        self.table.from_data(
+            self._model.wannier_centers_spreads['data'],
+            columns=self._model.wannier_centers_spreads['columns']
+        )
+
+    def _build_tight_binding_section(self):
+        # Bands interpolated locally from the real-space Hamiltonian, on any path
+        from ase.cell import Cell
+
+        lattice = self._model.get_tight_binding_model()['lattice']
+        self.tb_max_radius = ipw.BoundedFloatText(
+            value=self._model.tb_max_radius or 0.0, min=0.0, max=1000.0, step=1.0, description='Cutoff (Å):',
+        )
+        self.tb_max_radius.observe(self._on_tb_max_radius_change, names='value')
+        self.tb_path = ipw.Text(
+            value=Cell(lattice).bandpath(npoints=0).path,
+            description='Path:',
+            placeholder='e.g. GXWKGLUWLK,UX',
+        )
+        self.tb_npoints = ipw.BoundedIntText(value=300, min=10, max=100000, description='k-points:')
+        self.tb_compute = ipw.Button(description='Compute bands', icon='play')
+        self.tb_compute.on_click(self._on_tb_compute)
+        self.tb_message = ipw.HTML()
+        self.plot_tb_bands = go.FigureWidget(layout={
+            'title': 'Bands interpolated from the tight-binding model',
+            'yaxis': {'title': 'Energy (eV)'},
+            'showlegend': False,
+        })
+        self._on_tb_compute()
+
+        # Density of states on a dense mesh
+        self.dos_mesh = ipw.BoundedIntText(value=40, min=2, max=400, description='Mesh:')
+        self.dos_sigma = ipw.BoundedFloatText(value=0.05, min=0.001, max=1.0, step=0.01, description='σ (eV):')
+        self.dos_compute = ipw.Button(description='Compute DOS', icon='play')
+        self.dos_compute.on_click(self._on_dos_compute)
+        self.dos_message = ipw.HTML()
+        self.plot_tb_dos = go.FigureWidget(layout={
+            'title': 'Density of states',
+            'xaxis': {'title': 'DOS (states/eV/cell)'},
+            'yaxis': {'title': 'Energy (eV)'},
+        })
+        return [
+            ipw.HTML(
+                'Only the hoppings between Wannier functions whose cells are at most the cutoff apart are kept, '
+                'all of them if the cutoff is 0.'
+            ),
+            self.tb_max_radius,
+            ipw.HTML(
+                'Path of special points in the notation of ASE: consecutive letters are connected, '
+                'a comma starts a new segment.'
+            ),
+            ipw.HBox([self.tb_path, self.tb_npoints, self.tb_compute]),
+            self.tb_message,
+            ipw.HTML(
+                'Density of states on a Monkhorst-Pack mesh of N×N×N k-points, with the linear tetrahedron '
+                'method and with a Gaussian broadening σ.'
+            ),
+            ipw.HBox([self.dos_mesh, self.dos_sigma, self.dos_compute]),
+            self.dos_message,
+            ipw.HBox([self.plot_tb_bands, self.plot_tb_dos]),
+        ]
 
+    def _on_tb_max_radius_change(self, change):
+        self._model.tb_max_radius = change['new'] or None
+        self._on_tb_compute()
+
+    def _on_dos_compute(self, _=None):
+        """Compute the density of states in the background, and plot it in the thread of the kernel."""
+        model = self._model.get_tight_binding_model()
+        self.dos_compute.disabled = True
+        self.dos_message.value = 'Computing the density of states...'
+        future = self._task_executor.submit(
+            self._compute_dos, model, (self.dos_mesh.value,) * 3, self.dos_sigma.value,
+            self._model.get_dft_fermi_energy(),
+        )
+        future.add_done_callback(lambda f: self._io_loop.add_callback(self._plot_dos, f))
+
+    def _compute_dos(self, model, mesh, sigma, fermi_energy):
+        """Return the density of states of the tight-binding model, its Fermi level and the number of electrons.
+
+        The Fermi level of the Wannier model is the one for the number of electrons in the Wannier manifold
+        at the DFT ``fermi_energy``.
+        """
+        dos = compute_dos(model, mesh, sigma=sigma)
+        nelectrons = None
+        if fermi_energy is not None:
+            integrated = dos['tetrahedron']['integrated']
+            nelectrons = round(float(np.interp(fermi_energy, dos['energies'], integrated)))
+            try:
+                fermi_energy = fermi_level(dos['energies'], integrated, nelectrons)
+            except ValueError:
+                fermi_energy = None
+        return dos, fermi_energy, nelectrons
+
+    def _plot_dos(self, future):
+        """Plot the density of states computed by ``_compute_dos``."""
+        if self._closed:
+            return
+        self.dos_compute.disabled = False
+        try:
+            dos, fermi_energy, nelectrons = future.result()
+        except Exception as e:
+            self.dos_message.value = f'<span style="color: red;">Could not compute the density of states: {e}</span>'
+            return
+        self.dos_message.value = '' if fermi_energy is None else (
+            f'Fermi level for {nelectrons} electrons in the Wannier manifold: {fermi_energy:.4f} eV'
+        )
+        with self.plot_tb_dos.batch_update():
+            self.plot_tb_dos.data = []
+            for method in ('tetrahedron', 'gaussian'):
+                self.plot_tb_dos.add_scatter(x=dos[method]['dos'], y=dos['energies'], mode='lines', name=method)
+            self.plot_tb_dos.layout.shapes = [] if fermi_energy is None else [{
+                'type': 'line', 'xref': 'paper', 'x0': 0, 'x1': 1, 'y0': fermi_energy, 'y1': fermi_energy,
+                'line': {'dash': 'dot', 'color': 'black'},
+            }]
+
+    def _on_tb_compute(self, _=None):
+        try:
+            bands = interpolate_bandpath(
+                self._model.get_tight_binding_model(), self.tb_path.value, npoints=self.tb_npoints.value
+            )
+        except Exception as e:
+            self.tb_message.value = f'<span style="color: red;">Could not interpolate the bands: {e}</span>'
+            return
+        self.tb_message.value = ''
+        with self.plot_tb_bands.batch_update():
+            self.plot_tb_bands.data = []
+            for band in bands['eigenvalues'].T:
+                self.plot_tb_bands.add_scatter(x=bands['x'], y=band, mode='lines', line={'color': 'red'})
+            self.plot_tb_bands.layout.xaxis = {
+                'tickvals': list(bands['special_x']),
+                'ticktext': [label.replace('G', 'Γ') for label in bands['labels']],
+                'showgrid': True,
+            }
+
+    def _build_skeaf_section(self):
         # de Haas van Alphen (dHvA) frequencies
-        skeaf_data = self._model.get_skeaf()  # dictionary {band: frequency_array}
-        if skeaf_data is not None:
-            self.plot_skeaf = plot_skeaf(skeaf_data)
-            self.skeaf_container.children += (self.plot_skeaf,)
-        else:
-            # hide the skeaf container if no data is available
-            self.skeaf_container.layout.display = 'none'
+        skeaf_data = self._model.get_skeaf()  # dictionary {band: {'phi', 'theta', 'freq'}}
+        self.plot_skeaf = plot_skeaf(skeaf_data)
+        return [ipw.HTML('<h3>de Haas van Alphen (dHva) frequencies</h3>'), self.plot_skeaf]
 
+    def _build_downloads_section(self):
         # Downloads section
         download_links = []
         for filename in self._model.retrieved.list_object_names():
@@ -205,27 +479,41 @@ class Wannier90ResultsPanel(ResultsPanel[Wannier90ResultsModel]):
                     temp_dir, filename, description=f'Download the Fermi surface {filename}'
                 ))
 
-        # Arrange components in the panel
-        self.children = [
-            ipw.VBox([
-                ipw.HTML('<h2>DFT and Wannier-interpolated electronic band structure</h2>'),
-                bands_widget,
-            ]),
-            ipw.VBox([
-                ipw.HTML('<h2>Wannierization details</h2>'),
-                wannier90_outputs_parameters,
-                bands_distance_warning_widget if show_bands_distance_warning else ipw.HTML(''),
-                ipw.HBox([self.plot_omega_is, self.plot_omega_tots]),
-                table_section,
-                structure_viewer_section,
-            ]),
-            self.skeaf_container,
-            ipw.VBox([
-                ipw.HTML('<h2>Download files</h2>'),
-                ipw.VBox(download_links),
-            ]),
+        # Archive of the selected files, written while it is sent to the browser
+        folders = self._model.get_retrieved_folders()
+        self.bundle_groups = {
+            group: ipw.Checkbox(value=not group.startswith('Matrices'), description=group, indent=False)
+            for group, patterns in BUNDLE_FILE_GROUPS.items()
+            if list_bundle_files(folders, patterns)
+        }
+        self.download_bundle = ipw.Button(
+            description='Download the selected files as ZIP', icon='download', layout=ipw.Layout(width='auto'),
+        )
+        self.download_bundle.on_click(self._on_download_bundle)
+        self._bundle_output = ipw.Output(layout=ipw.Layout(display='none'))
+        return download_links + [
+            ipw.HTML('<h3>Archive of the results</h3>'),
+            *self.bundle_groups.values(),
+            self.download_bundle,
+            self._bundle_output,
         ]
 
+    def _on_download_bundle(self, _):
+        patterns = [
+            pattern
+            for group, checkbox in self.bundle_groups.items() if checkbox.value
+            for pattern in BUNDLE_FILE_GROUPS[group]
+        ]
+        files = list_bundle_files(self._model.get_retrieved_folders(), patterns)
+        if not files:
+            return
+        filename = f'wannier90_results_{self._model.fetch_process_node().pk}.zip'
+        self.download_bundle.disabled = True
+        try:
+            with BrowserDownload(filename, self._bundle_output) as target:
+                write_bundle(target, files)
+        finally:
+            self.download_bundle.disabled = False
 
     def on_single_row_select(self, change):
         id = change.get('new')
@@ -233,12 +521,13 @@ class Wannier90ResultsPanel(ResultsPanel[Wannier90ResultsModel]):
             return
 
         self._plot_wannier_function()
-        self.download_xsf.value = create_download_link(
+        self._prefetch_wannier_functions(selected_id=int(id))
+        self.download_xsf.children = [create_download_link(
             self.wannier90_plot_retrieved, f'aiida_{int(id):05d}.xsf',
             description=f'Download the Wannier function xsf file for WF id={id}'
-        ).value
+        )]
 
-    def _plot_wannier_function(self, isovalue=None):
+    def _plot_wannier_function(self, isovalue=None, step_size=1):
         """Plot the Wannier function corresponding to the selected row in the table."""
 
         # Get center for the selected row
@@ -263,47 +552,258 @@ class Wannier90ResultsPanel(ResultsPanel[Wannier90ResultsModel]):
 
         key = f'aiida_{int(id):05d}'
         # Check if the xsf file exists in the retrieved folder
-        if f'{key}.xsf' not in self.wannier90_plot_retrieved.list_object_names():
+        if f'{key}.xsf' not in self._xsf_filenames:
             return
 
-        if key not in self.isosurface_data:
-            data = process_xsf_file(folder=self.wannier90_plot_retrieved, prefix=key)
-            if data is None:
+        if isovalue is None:
+            isovalue = self._isovalues.get(key) or self._get_default_isovalue(key)
+            if isovalue is None:
                 return
-            self.isosurface_data[key] = data
-            self.isovalue.value = self.isosurface_data[key].get('isovalue', 0.1)
+            self._sync_isovalue_widgets(key, isovalue)
+        self._isovalues[key] = isovalue
+        self._requested_isovalue = isovalue
 
-        if isovalue and isovalue != self.isosurface_data[key].get('isovalue', None):
-            data = process_xsf_file(folder=self.wannier90_plot_retrieved, prefix=key, isovalue=isovalue)
-            if data is None:
+        if self.switch_supercell.value:
+            mesh = self._get_supercell_mesh(key, isovalue, step_size)
+        else:
+            mesh = self._get_mesh(key, isovalue, step_size)
+        if mesh is None:
+            return
+        data = []
+        for item in ['positive', 'negative']:
+            try:
+                vertices, faces = encode_mesh(mesh[f'{key}_{item}_vertices'], mesh[f'{key}_{item}_faces'])
+            except KeyError:
+                continue
+            data.append({
+                'name': item,
+                'color': ISOSURFACE_COLOR[item],
+                'material': 'Standard',
+                'position': [0, 0.0, 0.0],
+                'vertices': vertices,
+                'faces': faces,
+            })
+
+        with self._plot_lock:
+            # a refined mesh is outdated if the slider moved while it was computed
+            if isovalue != self._requested_isovalue:
                 return
-            self.isosurface_data[key] = data
+            self.structure_viewer.any_mesh.settings = data
+
+    def _get_grid(self, key):
+        """Return the parsed grid of a Wannier function, from the grid cache if possible."""
+        grid = self._grid_cache.get(key)
+        if grid is not None:
+            return grid
+        # avoid parsing the same grid twice when the prefetching and the UI ask for it at the same time
+        with self._grid_locks_guard:
+            lock = self._grid_locks.setdefault(key, threading.Lock())
+        with lock:
+            grid = self._grid_cache.get(key)
+            if grid is None:
+                grid = load_wannier_function_grid(self.wannier90_plot_retrieved, key)
+                self._grid_cache.put(key, grid)
+        return grid
+
+    def _get_default_isovalue(self, key):
+        node = (self._model.isosurfaces or {}).get(key)
+        if node is not None:
+            return node.base.attributes.get('default_isovalue')
+        try:
+            return self._get_grid(key)['isovalue']
+        except Exception as e:
+            logger.warning('Error processing xsf file %s.xsf: %s', key, e)
+            return None
+
+    def _get_isovalue_index(self, key):
+        """Return the isovalue index of a Wannier function, see ``build_isovalue_index``."""
+        node = (self._model.isosurfaces or {}).get(key)
+        if node is not None and 'isovalue_index_magnitudes' in node.get_arraynames():
+            return {
+                'magnitudes': node.get_array('isovalue_index_magnitudes'),
+                'fractions': node.get_array('isovalue_index_fractions'),
+            }
+        try:
+            return self._get_grid(key)['isovalue_index']
+        except Exception:
+            return None
 
-        if key in self.isosurface_data:
-            mesh = self.isosurface_data[key].get('mesh_data', {})
-            data = []
+    def _sync_isovalue_widgets(self, key, isovalue):
+        """Adapt the range of the isovalue slider to the Wannier function and set the sliders without plotting."""
+        index = self._get_isovalue_index(key)
+        self._syncing_isovalue = True
+        try:
+            if index is not None:
+                # from the isovalue enclosing almost all the density to the maximum of |ψ|
+                low = isovalue_from_fraction(index, 0.999)
+                high = float(index['magnitudes'][0])
+                if high > low:
+                    self.isovalue.max = max(high, self.isovalue.min)
+                    self.isovalue.min = low
+                    self.isovalue.max = high
+                    self.isovalue.step = (high - low) / 500
+                self.enclosed_fraction.value = fraction_from_isovalue(index, isovalue)
+            self.isovalue.value = isovalue
+        finally:
+            self._syncing_isovalue = False
+
+    def _get_mesh(self, key, isovalue, step_size=1):
+        """Return the isosurfaces of a Wannier function, from the mesh cache if possible."""
+        cache_key = (key, float(isovalue), step_size)
+        mesh = self._mesh_cache.get(cache_key)
+        if mesh is None:
+            # coarse meshes are cheap, computing them in the kernel avoids the round-trip to the workers
+            executor = self._get_mesh_executor() if step_size == 1 else None
+            mesh = self._load_isosurface(key, isovalue, step_size, executor)
+            if mesh is None:
+                return None
+            # weld the full-resolution meshes once, so that the cache holds compact meshes ready to be sent;
+            # the coarse meshes are only shown while the slider moves, welding them would cost more than it saves
             for item in ['positive', 'negative']:
-                try:
-                    vertices = mesh[f'{key}_{item}_vertices'].tolist()
-                    faces = mesh[f'{key}_{item}_faces'].tolist()
-                except KeyError:
-                    continue
-                data.append({
-                    'name': item,
-                    'color': ISOSURFACE_COLOR[item],
-                    'material': 'Standard',
-                    'position': [0, 0.0, 0.0],
-                    'vertices': vertices,
-                    'faces': faces,
-                })
-
-        self.structure_viewer.any_mesh.settings = data
+                vertices, faces = mesh[f'{key}_{item}_vertices'], mesh[f'{key}_{item}_faces']
+                if step_size == 1:
+                    vertices, faces = weld_mesh(vertices, faces)
+                mesh[f'{key}_{item}_vertices'] = np.asarray(vertices, dtype=np.float32)
+                mesh[f'{key}_{item}_faces'] = np.asarray(faces, dtype=np.uint32)
+            self._mesh_cache.put(cache_key, mesh)
+        return mesh
+
+    def _get_supercell_mesh(self, key, isovalue, step_size=1):
+        """Return the isosurfaces tiled over the periodic images shown in the supercell view.
+
+        The mesh of the Wannier function is translated by the lattice vectors of the structure, so no
+        isosurface is recomputed and no larger xsf file is needed.
+        """
+        cache_key = (key, float(isovalue), step_size, 'supercell')
+        tiled = self._mesh_cache.get(cache_key)
+        if tiled is None:
+            mesh = self._get_mesh(key, isovalue, step_size)
+            if mesh is None:
+                return None
+            translations = lattice_translations(self._model.structure.cell)
+            tiled = {}
+            for item in ['positive', 'negative']:
+                tiled[f'{key}_{item}_vertices'], tiled[f'{key}_{item}_faces'] = tile_mesh(
+                    mesh[f'{key}_{item}_vertices'], mesh[f'{key}_{item}_faces'], translations
+                )
+            self._mesh_cache.put(cache_key, tiled)
+        return tiled
+
+    def _load_isosurface(self, key, isovalue, step_size=1, executor=None):
+        """Load the isosurface precomputed by the workchain if available, otherwise compute it from the grid."""
+        node = (self._model.isosurfaces or {}).get(key)
+        if node is not None:
+            data = load_isosurface_mesh(node, key, isovalue)
+            if data is not None:
+                return data['mesh_data']
+        try:
+            return compute_wannier_function_mesh(
+                self._get_grid(key), key, isovalue, step_size=step_size, block_size=ISOSURFACE_BLOCK_SIZE,
+                executor=executor,
+            )
+        except Exception as e:
+            logger.warning('Error processing xsf file %s.xsf: %s', key, e)
+            return None
+
+    def _get_mesh_executor(self):
+        """Return the pool of worker processes computing the meshes, started on first use.
+
+        :return: the pool, or None once the panel is closed.
+        """
+        with self._executor_lock:
+            if self._mesh_executor is None and not self._closed:
+                self._mesh_executor = ProcessPoolExecutor(
+                    max_workers=MESH_WORKERS, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._mesh_executor
+
+    def close(self):
+        """Stop the background work and the worker processes, then close the panel."""
+        if hasattr(self, '_executor_lock'):
+            with self._executor_lock:
+                self._closed = True
+                mesh_executor, self._mesh_executor = self._mesh_executor, None
+            if self._refine_timer is not None:
+                self._refine_timer.cancel()
+            self._prefetch_executor.shutdown(wait=False, cancel_futures=True)
+            self._task_executor.shutdown(wait=False, cancel_futures=True)
+            if mesh_executor is not None:
+                mesh_executor.shutdown(wait=False, cancel_futures=True)
+        super().close()
+
+    def _prefetch_wannier_functions(self, selected_id=1):
+        """Prefetch in the background the grids and meshes of the Wannier functions next to the selected one.
+
+        Only the ``PREFETCH_WINDOW`` nearest rows are prefetched, nearest first, so that the Wannier functions
+        further away do not evict them from the caches.
+        """
+        for future in self._prefetch_futures:
+            future.cancel()
+        if self._closed:
+            return
+        ids = sorted((row['id'] for row in self.table.data), key=lambda i: abs(i - selected_id))
+        keys = [f'aiida_{int(i):05d}' for i in ids]
+        keys = [key for key in keys if f'{key}.xsf' in self._xsf_filenames][:PREFETCH_WINDOW + 1]
+        self._prefetch_futures = [self._prefetch_executor.submit(self._prefetch_wannier_function, key) for key in keys]
+
+    def _prefetch_wannier_function(self, key):
+        isovalue = self._isovalues.get(key) or self._get_default_isovalue(key)
+        if isovalue is not None:
+            self._get_mesh(key, isovalue)
 
     def _on_isovalue_change(self, change):
         """Handle isovalue change event."""
-        self._plot_wannier_function(
-            isovalue=change['new']
+        if self._syncing_isovalue:
+            return
+        if self._refine_timer is not None:
+            self._refine_timer.cancel()
+        key = f'aiida_{int(self.table.selectedRowId):05d}' if self.table.selectedRowId is not None else None
+        index = self._get_isovalue_index(key) if key else None
+        if index is not None:
+            self._syncing_isovalue = True
+            try:
+                self.enclosed_fraction.value = fraction_from_isovalue(index, change['new'])
+            finally:
+                self._syncing_isovalue = False
+        if (key, float(change['new']), 1) in self._mesh_cache:
+            self._plot_wannier_function(isovalue=change['new'])
+            return
+        # Show a coarse mesh right away, and refine it once the slider stops moving
+        self._plot_wannier_function(isovalue=change['new'], step_size=COARSE_STEP_SIZE)
+        if key is None:
+            return
+        self._refine_timer = threading.Timer(
+            REFINE_DELAY, self._refine_wannier_function, args=(key, change['new'], self.switch_supercell.value)
         )
+        self._refine_timer.daemon = True
+        self._refine_timer.start()
+
+    def _refine_wannier_function(self, key, isovalue, supercell):
+        """Compute the full-resolution mesh in the background, and plot it in the thread of the kernel."""
+        if self._closed:
+            return
+        try:
+            mesh = self._get_supercell_mesh(key, isovalue) if supercell else self._get_mesh(key, isovalue)
+        except Exception:
+            logger.exception('Could not refine the isosurface of %s', key)
+            return
+        if mesh is not None:
+            self._io_loop.add_callback(self._plot_refined_wannier_function, key, isovalue)
+
+    def _plot_refined_wannier_function(self, key, isovalue):
+        """Plot the mesh computed by ``_refine_wannier_function``, now in the cache, unless it is outdated."""
+        selected = self.table.selectedRowId
+        if self._closed or selected is None or key != f'aiida_{int(selected):05d}' or isovalue != self.isovalue.value:
+            return
+        self._plot_wannier_function(isovalue=isovalue)
+
+    def _on_enclosed_fraction_change(self, change):
+        """Set the isovalue whose isosurface encloses the selected fraction of the density."""
+        if self._syncing_isovalue or self.table.selectedRowId is None:
+            return
+        index = self._get_isovalue_index(f'aiida_{int(self.table.selectedRowId):05d}')
+        if index is not None:
+            self.isovalue.value = isovalue_from_fraction(index, change['new'])
 
     def _on_switch_supercell_change(self, change):
         """Handle supercell switch change event."""
@@ -313,3 +813,6 @@ class Wannier90ResultsPanel(ResultsPanel[Wannier90ResultsModel]):
             self.structure_viewer.avr.boundary = [[-0.05, 1.05], [-0.05, 1.05], [-0.05, 1.05]]
 
         self.structure_viewer.avr.draw()
+        # Show (or hide) the periodic images of the selected Wannier function
+        if self.table.selectedRowId is not None:
+            self._plot_wannier_function(isovalue=self._requested_isovalue)
@@ -0,0 +1,26 @@
+"""Compact summary of the results of a Wannier90 workchain, cached in the extras of its node.
+
+The summary contains everything shown in the results panel that has to be computed from raw outputs
+(output parameters, parsed output files, XSF grids), as plain JSON-serializable values.
+Increase ``SUMMARY_VERSION`` whenever its content changes, so that stale summaries are rebuilt.
+"""
+
+from aiida import orm
+
+SUMMARY_VERSION = 2
+SUMMARY_EXTRA = 'aiidalab_qe_wannier90_summary'
+
+
+def load_summary(node: orm.ProcessNode):
+    """Return the summary stored in the extras of ``node``, or None if missing or of another version."""
+    summary = node.base.extras.get(SUMMARY_EXTRA, None)
+    if summary and summary.get('version') == SUMMARY_VERSION:
+        return summary
+    return None
+
+
+def store_summary(node: orm.ProcessNode, summary: dict):
+    """Store the summary in the extras of ``node``, tagged with the current version."""
+    summary = {**summary, 'version': SUMMARY_VERSION}
+    node.base.extras.set(SUMMARY_EXTRA, summary)
+    return summary
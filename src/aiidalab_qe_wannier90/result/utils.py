@@ -1,27 +1,197 @@
-def create_download_link(obj, filename, description='Download'):
-    """Create a download link for a file in the AiiDA repository using a temporary directory."""
-    import base64
+import io
+
+DOWNLOAD_CHUNK_SIZE = 4 * 1024**2  # bytes
+
+
+class BrowserDownload(io.RawIOBase):
+    """A write-only stream that sends its content to the browser, where it is saved as ``filename`` when closed.
+
+    The content is sent in chunks, each one as a small Javascript output of ``output`` that decodes it
+    into the browser memory; on close, the chunks are assembled in a ``Blob`` and downloaded.
+    Only one chunk at a time is held by the kernel and by the ``Output`` widget.
+    The stream is not seekable, so it can be used as the target of a ``zipfile.ZipFile``.
+    """
+
+    def __init__(self, filename, output, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        import json
+        import uuid
+
+        super().__init__()
+        self.filename = filename
+        self.output = output
+        self.chunk_size = chunk_size
+        self._buffer = bytearray()
+        self._parts = f'window[{json.dumps("download-" + uuid.uuid4().hex)}]'
+        self._display(f'{self._parts} = [];')
+
+    def _display(self, code):
+        from IPython.display import Javascript, display
+
+        with self.output:
+            self.output.clear_output(wait=True)
+            display(Javascript(code))
+
+    def _send(self, chunk):
+        import base64
+
+        self._display(
+            f"""
+            (function () {{
+                var data = atob('{base64.b64encode(chunk).decode()}');
+                var bytes = new Uint8Array(data.length);
+                for (var i = 0; i < data.length; i++) {{ bytes[i] = data.charCodeAt(i); }}
+                {self._parts}.push(bytes);
+            }})();
+            """
+        )
+
+    def writable(self):
+        return True
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        self.close()
+
+    def __del__(self):
+        # never download an incomplete file
+        if not self.closed:
+            self.abort()
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.chunk_size:
+            self._send(bytes(self._buffer[:self.chunk_size]))
+            del self._buffer[:self.chunk_size]
+        return len(data)
+
+    def close(self):
+        import json
+
+        if self.closed:
+            return
+        if self._buffer:
+            self._send(bytes(self._buffer))
+            self._buffer.clear()
+        self._display(
+            f"""
+            var link = document.createElement('a');
+            link.href = URL.createObjectURL(new Blob({self._parts}, {{type: 'application/octet-stream'}}));
+            link.download = {json.dumps(self.filename)};
+            delete {self._parts};
+            document.body.appendChild(link);
+            link.click();
+            document.body.removeChild(link);
+            setTimeout(function () {{ URL.revokeObjectURL(link.href); }}, 60000);
+            """
+        )
+        self.output.clear_output()
+        super().close()
+
+    def abort(self):
+        """Discard the content sent so far, without downloading it."""
+        if self.closed:
+            return
+        self._buffer.clear()
+        self._display(f'delete {self._parts};')
+        self.output.clear_output()
+        super().close()
+
+
+def stream_download(handle, filename, output, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Send a binary stream to the browser in chunks, and save it there as ``filename``."""
     import shutil
-    import tempfile
+
+    with BrowserDownload(filename, output, chunk_size=chunk_size) as target:
+        shutil.copyfileobj(handle, target, chunk_size)
+
+
+BUNDLE_FILE_GROUPS = {
+    'Tight-binding model (_tb.dat)': ('*_tb.dat',),
+    'Fermi surface (.bxsf)': ('*.bxsf',),
+    'Wannier functions (.xsf)': ('aiida_*.xsf',),
+    'Wannier90 output (.wout)': ('aiida.wout',),
+    'Matrices and checkpoint (.amn, .mmn, .eig, .chk)': ('*.amn', '*.mmn', '*.eig', '*.chk'),
+}
+
+
+def list_bundle_files(folders, patterns):
+    """List the files of the retrieved folders matching any of the glob ``patterns``.
+
+    :param folders: a dictionary {label: FolderData}, the label is used as directory in the archive.
+    :return: a list of (arcname, folder, filename) tuples.
+    """
+    from fnmatch import fnmatch
+
+    return [
+        (f'{label}/{filename}', folder, filename)
+        for label, folder in folders.items()
+        for filename in sorted(folder.list_object_names())
+        if any(fnmatch(filename, pattern) for pattern in patterns)
+    ]
+
+
+def write_bundle(target, files, compresslevel=6, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Write a ZIP archive of repository files to the binary stream ``target``, which does not need to be seekable.
+
+    Each file is streamed from the repository into the archive chunk by chunk, so the memory used does not
+    depend on the size of the files. A ``MANIFEST.json`` with the source node, size and SHA-256 of every
+    file is added at the end.
+
+    :param files: a list of (arcname, folder, filename) tuples, see :func:`list_bundle_files`.
+    """
+    import hashlib
+    import json
+    import zipfile
+
+    manifest = []
+    with zipfile.ZipFile(target, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as archive:
+        for arcname, folder, filename in files:
+            digest = hashlib.sha256()
+            size = 0
+            with folder.open(filename, 'rb') as source, archive.open(arcname, 'w', force_zip64=True) as dest:
+                for chunk in iter(lambda: source.read(chunk_size), b''):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    dest.write(chunk)
+            manifest.append({
+                'path': arcname,
+                'node': folder.uuid,
+                'filename': filename,
+                'size': size,
+                'sha256': digest.hexdigest(),
+            })
+        archive.writestr('MANIFEST.json', json.dumps({'files': manifest}, indent=2))
+    return manifest
+
+
+def create_download_link(obj, filename, description='Download'):
+    """Create a button that downloads a file of the AiiDA repository when clicked.
+
+    The file is streamed from the repository in chunks (see :func:`stream_download`), nothing is
+    read before the button is clicked.
+    """
     import ipywidgets as ipw
-    from pathlib import Path
-    # Create a temporary directory to store the file
-    # Copy the file from the AiiDA repository to the temporary directory
-    with obj.as_path(filename) as source_path:
-        with tempfile.TemporaryDirectory() as tmpdir:
-            tmp_path = Path(tmpdir) / filename
-            shutil.copy(source_path, tmp_path)
-
-            with open(tmp_path, 'rb') as f:
-                b64 = base64.b64encode(f.read()).decode()
-
-    # At this point, we no longer need the file; it's encoded.
-    payload = f'data:application/octet-stream;base64,{b64}'
-    html = f'<a download="{filename}" href="{payload}" target="_blank">{description}</a>'
-    return ipw.HTML(html)
+
+    button = ipw.Button(description=description, icon='download', layout=ipw.Layout(width='auto'))
+    output = ipw.Output(layout=ipw.Layout(display='none'))
+
+    def download(_):
+        button.disabled = True
+        try:
+            with obj.open(filename, 'rb') as handle:
+                stream_download(handle, filename, output)
+        finally:
+            button.disabled = False
+
+    button.on_click(download)
+    return ipw.VBox([button, output])
 
 def plot_skeaf(skeaf_data):
-    """Plot the de Haas van Alphen (dHvA) frequencies from a Wannier90 workchain."""
+    """Plot the de Haas van Alphen (dHvA) frequencies from a Wannier90 workchain.
+
+    :param skeaf_data: a dictionary {band: {'phi': ..., 'theta': ..., 'freq': ...}} of arrays.
+    """
     import numpy as np
     import plotly.express as px
     import plotly.graph_objects as go
@@ -31,11 +201,11 @@ def plot_skeaf(skeaf_data):
     labels = []    # band names for color grouping
     xlabel = 'Rotation step'
 
-    for band, array_node in skeaf_data.items():
+    for band, arrays in skeaf_data.items():
 
-        phi = array_node.get_array('phi')
-        theta = array_node.get_array('theta')
-        freq = array_node.get_array('freq')
+        phi = np.asarray(arrays['phi'])
+        theta = np.asarray(arrays['theta'])
+        freq = np.asarray(arrays['freq'])
 
         if len(np.unique(phi)) == 1:
             if len(np.unique(theta)) > 1:
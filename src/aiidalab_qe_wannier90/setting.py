@@ -53,7 +53,7 @@ class ConfigurationSettingPanel(
             This workflow consists of two main steps:
             <ul>
                 <li><strong>Step 1:</strong> Run a Quantum ESPRESSO workflow (<code>PwBandsWorkChain</code>) to compute the self-consistent (SCF) DFT charge density and corresponding DFT band structure along a standard path.</li>
-                <li><strong>Step 2:</strong> Use the SCF charge density as input for the Wannierization workflow, using the Wannier90 code (<code>Wannier90OptimizeWorkChain</code>). The workflow will compute maximally localized Wannier functions (MLWFs) and compare the interpolated bands with the DFT bands internally. The corresponding band distance <code>η</code> is one of the outputs and is a measure of the interpolation quality (typically good if <code>η ≤ 30</code> meV).</li>
+                <li><strong>Step 2:</strong> Use the SCF charge density as input for the Wannierization workflow, using the Wannier90 code (<code>Wannier90OptimizeWorkChain</code>). This step starts as soon as the SCF is done, at the same time as the DFT band structure. The workflow will compute maximally localized Wannier functions (MLWFs) and compare the interpolated bands with the DFT bands once both are done. The corresponding band distance <code>η</code> is one of the outputs and is a measure of the interpolation quality (typically good if <code>η ≤ 30</code> meV).</li>
             </ul>
             </div>
             </details>"""
@@ -99,6 +99,49 @@ class ConfigurationSettingPanel(
             (self._model, 'scan_pdwf_parameter'),
             (self.scan_pdwf_parameter, 'value'),
         )
+        self.scan_mode = ipw.Dropdown(
+            options=[
+                ('Serial (one Wannierization after the other)', 'serial'),
+                ('Concurrent (stop at the first point below 10 meV)', 'concurrent'),
+                ('Adaptive (coarse-to-fine search, stop below 10 meV)', 'adaptive'),
+            ],
+            value=self._model.scan_mode,
+            description='Scan mode: ',
+            style={'description_width': 'initial'},
+        )
+        ipw.link(
+            (self._model, 'scan_mode'),
+            (self.scan_mode, 'value'),
+        )
+        self.max_concurrent_wannierizations = ipw.BoundedIntText(
+            value=self._model.max_concurrent_wannierizations,
+            min=1,
+            max=30,
+            description='Maximum number of concurrent Wannierizations: ',
+            style={'description_width': 'initial'},
+        )
+        ipw.link(
+            (self._model, 'max_concurrent_wannierizations'),
+            (self.max_concurrent_wannierizations, 'value'),
+        )
+        self.scan_warm_start = ipw.Checkbox(
+            value=self._model.scan_warm_start,
+            description='Only localise the best point, restarting from its checkpoint',
+            style={'description_width': 'initial'},
+            tooltip='If enabled, the scan points are only disentangled (no wannierisation iterations), and the '
+            'Wannier functions of the best point are then localised, restarting from its checkpoint.',
+        )
+        ipw.link(
+            (self._model, 'scan_warm_start'),
+            (self.scan_warm_start, 'value'),
+        )
+        self.scan_options_vbox = ipw.VBox(
+            children=[self.scan_mode, self.max_concurrent_wannierizations, self.scan_warm_start],
+            layout=ipw.Layout(display='flex' if self._model.scan_pdwf_parameter else 'none', margin='0 0 0 20px'),
+        )
+        self.scan_pdwf_parameter.observe(self._update_scan_options_visibility, names='value')
+        self.scan_mode.observe(self._update_scan_options_visibility, names='value')
+        self._update_scan_options_visibility()
         self.plot_wannier_functions = ipw.Checkbox(
             value=self._model.plot_wannier_functions,
             description='Compute real-space Wannier functions',
@@ -108,6 +151,21 @@ class ConfigurationSettingPanel(
             (self._model, 'plot_wannier_functions'),
             (self.plot_wannier_functions, 'value'),
         )
+        self.generate_isosurface = ipw.Checkbox(
+            value=self._model.generate_isosurface,
+            description='Precompute the isosurfaces of the Wannier functions',
+            style={'description_width': 'initial'},
+            tooltip='If enabled, the isosurfaces are computed by the AiiDA daemon at the end of the workflow, '
+            'so that the results panel only loads them. Otherwise they are computed when they are shown.',
+            layout=ipw.Layout(
+                display='flex' if self._model.plot_wannier_functions else 'none', margin='0 0 0 20px'
+            ),
+        )
+        ipw.link(
+            (self._model, 'generate_isosurface'),
+            (self.generate_isosurface, 'value'),
+        )
+        self.plot_wannier_functions.observe(self._update_generate_isosurface_visibility, names='value')
         self.compute_fermi_surface = ipw.Checkbox(
             value = self._model.compute_fermi_surface,
             description='Compute Fermi surface',
@@ -334,6 +392,7 @@ class ConfigurationSettingPanel(
             workflow_explanation,
             self.exclude_semicore,
             self.plot_wannier_functions,
+            self.generate_isosurface,
             self.retrieve_hamiltonian,
             self.retrieve_matrices,
             self.compute_fermi_surface,
@@ -343,6 +402,7 @@ class ConfigurationSettingPanel(
             self.projection_selection_widget,
             self.frozen_states_widget,
             self.scan_pdwf_parameter,
+            self.scan_options_vbox,
         ]
         self.rendered = True
 
@@ -354,6 +414,15 @@ class ConfigurationSettingPanel(
         else:
             self.error_message.value = ''
 
+    def _update_scan_options_visibility(self, _=None):
+        self.scan_options_vbox.layout.display = 'flex' if self.scan_pdwf_parameter.value else 'none'
+        self.max_concurrent_wannierizations.layout.display = (
+            'none' if self.scan_mode.value == 'serial' else 'flex'
+        )
+
+    def _update_generate_isosurface_visibility(self, change):
+        self.generate_isosurface.layout.display = 'flex' if change['new'] else 'none'
+
     # Function to toggle the visibility of the energy window input
     def _update_energy_window_visibility(self, change):
         if change['new'] in ['fixed_plus_projectability', 'energy_fixed']:
@@ -0,0 +1,394 @@
+"""Tight-binding models from the ``_tb.dat`` file written by Wannier90 (``write_tb = .true.``)."""
+
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+from aiida import orm
+
+from .cache import atomic_write, get_cache_dir, get_object_key
+from .utils import XSF_CHUNK_SIZE, _ChunkReader
+
+# memory budget (in bytes) of the work arrays when evaluating the Hamiltonian on many k-points
+TB_CHUNK_BYTES = 64 * 1024**2
+# upper bound of the number of 8-byte work arrays of `_tetrahedron_counts`, per interpolated (tetrahedron, energy)
+TETRAHEDRON_WORK_ARRAYS = 16
+
+
+def _read_numbers(reader, count):
+    """Parse exactly ``count`` numbers chunk by chunk into a preallocated array; the remaining text is pushed back."""
+    out = np.empty(count, dtype=np.float64)
+    position = 0
+    remainder = ''
+    while position < count:
+        chunk = reader.read()
+        if not chunk and not remainder:
+            raise ValueError(f'Unexpected end of file: expected {count} values, got {position}')
+        text = remainder + chunk
+        if chunk:
+            # keep the last, possibly incomplete, token for the next chunk
+            cut = max(text.rfind(' '), text.rfind('\n'))
+            if cut == -1:
+                remainder = text
+                continue
+            text, remainder = text[:cut], text[cut:]
+        else:
+            remainder = ''
+        tokens = text.split(None, count - position)
+        if len(tokens) > count - position:
+            # the last token contains the text after the values
+            reader.unread(tokens.pop() + remainder)
+            remainder = ''
+        values = np.array(tokens, dtype=np.float64)
+        out[position:position + values.size] = values
+        position += values.size
+    if remainder:
+        reader.unread(remainder)
+    return out
+
+
+def parse_tb_dat(handle, chunk_size=XSF_CHUNK_SIZE):
+    """Parse a ``_tb.dat`` file chunk by chunk.
+
+    :return: a dict with the ``lattice`` (Å, one vector per row), the ``irvec`` (nrpts, 3) and ``ndegen`` (nrpts)
+        of the Wigner-Seitz R vectors, the ``hamiltonian`` H_mn(R) (nrpts, num_wann, num_wann, eV) and the
+        ``position`` matrices r_mn(R) (nrpts, 3, num_wann, num_wann, Å), both complex128.
+    """
+    reader = _ChunkReader(handle, chunk_size)
+    reader.readline()  # header with the date
+    lattice = _read_numbers(reader, 9).reshape(3, 3)
+    num_wann, nrpts = _read_numbers(reader, 2).astype(int)
+    ndegen = _read_numbers(reader, nrpts).astype(int)
+
+    def read_blocks(ncomponents):
+        # for each R vector: the R vector, then the lines "m n Re(x1) Im(x1) ..." with n outer and m inner
+        blocks = _read_numbers(reader, nrpts * (3 + num_wann**2 * (2 + 2 * ncomponents)))
+        blocks = blocks.reshape(nrpts, -1)
+        irvec = blocks[:, :3].astype(int)
+        rows = blocks[:, 3:].reshape(nrpts, num_wann**2, 2 + 2 * ncomponents)
+        m = rows[0, :, 0].astype(int) - 1
+        n = rows[0, :, 1].astype(int) - 1
+        matrices = np.zeros((nrpts, ncomponents, num_wann, num_wann), dtype=np.complex128)
+        matrices[:, :, m, n] = (rows[:, :, 2::2] + 1j * rows[:, :, 3::2]).transpose(0, 2, 1)
+        return irvec, matrices
+
+    irvec, hamiltonian = read_blocks(1)
+    _, position = read_blocks(3)
+    return {
+        'lattice': lattice,
+        'irvec': irvec,
+        'ndegen': ndegen,
+        'hamiltonian': hamiltonian[:, 0],
+        'position': position,
+    }
+
+
+def read_tb_dat(folder: orm.FolderData, filename: str):
+    """Parse a ``_tb.dat`` file of the AiiDA repository, see :func:`parse_tb_dat`."""
+    with folder.open(filename) as handle:
+        return parse_tb_dat(handle)
+
+
+TB_CACHE_VERSION = 1
+TB_CACHE_ARRAYS = ('lattice', 'irvec', 'ndegen', 'hamiltonian', 'position')
+
+
+def _tb_cache_dir(folder: orm.FolderData, filename: str):
+    return get_cache_dir('tight_binding', folder.uuid, Path(filename).stem)
+
+
+def cache_tb_dat(folder: orm.FolderData, filename: str):
+    """Convert a ``_tb.dat`` file into memory-mappable ``.npy`` files in the local cache.
+
+    The R vectors are sorted by shell, i.e. by their length, and the offset of every shell is stored in the
+    metadata, so that the matrices of the first shells are at the beginning of the files and can be mapped
+    without reading the others. The cache is keyed by the UUID of the node and by the repository key of the file.
+
+    :return: the cache directory.
+    """
+    directory = _tb_cache_dir(folder, filename)
+    meta_path = directory / 'metadata.json'
+    key = get_object_key(folder, filename)
+    if meta_path.exists():
+        metadata = json.loads(meta_path.read_text())
+        if (metadata.get('version'), metadata.get('key')) == (TB_CACHE_VERSION, key):
+            return directory
+
+    model = read_tb_dat(folder, filename)
+    lengths = np.linalg.norm(model['irvec'] @ model['lattice'], axis=1).round(6)
+    order = np.argsort(lengths, kind='stable')
+    shells, offsets = np.unique(lengths[order], return_index=True)
+    for name in ('irvec', 'ndegen', 'hamiltonian', 'position'):
+        model[name] = model[name][order]
+    # the metadata is written last, so that an interrupted conversion is not used
+    meta_path.unlink(missing_ok=True)
+    for name in TB_CACHE_ARRAYS:
+        with atomic_write(directory / f'{name}.npy') as f:
+            np.save(f, np.ascontiguousarray(model[name]))
+    metadata = {
+        'version': TB_CACHE_VERSION,
+        'key': key,
+        'num_wann': int(model['hamiltonian'].shape[1]),
+        'shells': shells.tolist(),
+        'shell_offsets': offsets.tolist() + [len(order)],
+    }
+    with atomic_write(meta_path, 'w') as f:
+        json.dump(metadata, f)
+    return directory
+
+
+def load_tb_model(folder: orm.FolderData, filename: str, max_radius=None):
+    """Load a tight-binding model from the cache, converting the ``_tb.dat`` file on first access.
+
+    The arrays are memory-mapped read-only: pages are only read when they are used, e.g. the position
+    matrices are not read at all to interpolate the bands.
+
+    :param max_radius: if given, only the shells of R vectors not longer than ``max_radius`` (Å) are kept.
+    :return: a dict with the same layout as :func:`parse_tb_dat`.
+    """
+    directory = cache_tb_dat(folder, filename)
+    metadata = json.loads((directory / 'metadata.json').read_text())
+    nrpts = metadata['shell_offsets'][-1]
+    if max_radius is not None:
+        nshells = int(np.searchsorted(metadata['shells'], max_radius, side='right'))
+        nrpts = metadata['shell_offsets'][nshells]
+    model = {name: np.load(directory / f'{name}.npy', mmap_mode='r') for name in TB_CACHE_ARRAYS}
+    for name in ('irvec', 'ndegen', 'hamiltonian', 'position'):
+        model[name] = model[name][:nrpts]
+    return model
+
+
+def _chunk_size(model, max_bytes):
+    """Number of k-points whose work arrays fit in ``max_bytes``."""
+    nrpts, num_wann = model['hamiltonian'].shape[:2]
+    # phase factors, H(k) and the workspace of the diagonalization, in complex128
+    per_kpoint = 16 * (nrpts + 3 * num_wann**2)
+    return max(1, int(max_bytes // per_kpoint))
+
+
+def hamiltonian_k(model, kpoints):
+    """Fourier-interpolate the Hamiltonian: H(k) = Σ_R exp(2πi k·R) H(R) / ndegen(R).
+
+    :param kpoints: (nk, 3) k-points in fractional coordinates of the reciprocal lattice.
+    :return: the (nk, num_wann, num_wann) Hamiltonians.
+    """
+    kpoints = np.atleast_2d(kpoints)
+    hamiltonian = model['hamiltonian']
+    phases = np.exp(2j * np.pi * (kpoints @ model['irvec'].T)) / model['ndegen']
+    # a single matrix product over all the R vectors
+    return (phases @ hamiltonian.reshape(hamiltonian.shape[0], -1)).reshape(len(kpoints), *hamiltonian.shape[1:])
+
+
+def iter_eigenvalues(model, kpoints, max_bytes=TB_CHUNK_BYTES):
+    """Yield the slices and eigenvalues of ``kpoints`` in chunks whose work arrays fit in ``max_bytes``."""
+    kpoints = np.atleast_2d(kpoints)
+    chunk = _chunk_size(model, max_bytes)
+    for start in range(0, len(kpoints), chunk):
+        stop = min(start + chunk, len(kpoints))
+        yield slice(start, stop), np.linalg.eigvalsh(hamiltonian_k(model, kpoints[start:stop]))
+
+
+def eigenvalues(model, kpoints, max_bytes=TB_CHUNK_BYTES):
+    """Return the (nk, num_wann) eigenvalues (eV) at ``kpoints``, computed in memory-bounded chunks."""
+    kpoints = np.atleast_2d(kpoints)
+    out = np.empty((len(kpoints), model['hamiltonian'].shape[1]))
+    for index, values in iter_eigenvalues(model, kpoints, max_bytes):
+        out[index] = values
+    return out
+
+
+def interpolate_bandpath(model, path, npoints=200):
+    """Interpolate the bands along a path of high-symmetry points.
+
+    :param path: the path, in the notation of ``ase.cell.Cell.bandpath``, e.g. ``'GXWKGLUWLK,UX'``.
+    :param npoints: the total number of k-points along the path.
+    :return: a dict with the ``kpoints`` (fractional), the linear axis ``x``, the positions
+        and labels of the special points, and the ``eigenvalues`` (eV).
+    """
+    from ase.cell import Cell
+
+    bandpath = Cell(model['lattice']).bandpath(path, npoints=npoints)
+    x, special_x, labels = bandpath.get_linear_kpoint_axis()
+    return {
+        'kpoints': bandpath.kpts,
+        'x': x,
+        'special_x': special_x,
+        'labels': labels,
+        'eigenvalues': eigenvalues(model, bandpath.kpts),
+    }
+
+
+def monkhorst_pack_plane(mesh, index):
+    """Return the k-points (fractional) of the plane ``index`` along the first axis of a Monkhorst-Pack mesh."""
+    n1, n2, n3 = mesh
+    k2, k3 = ((2 * np.arange(n) - n + 1) / (2 * n) for n in (n2, n3))
+    kpoints = np.empty((n2, n3, 3))
+    kpoints[..., 0] = (2 * index - n1 + 1) / (2 * n1)
+    kpoints[..., 1] = k2[:, None]
+    kpoints[..., 2] = k3[None, :]
+    return kpoints.reshape(-1, 3)
+
+
+# the 6 tetrahedra of a cube sharing its main diagonal; corner i is at the offset (i >> 2, i >> 1 & 1, i & 1)
+CUBE_TETRAHEDRA = np.array([[0, 1, 3, 7], [0, 1, 5, 7], [0, 2, 3, 7], [0, 2, 6, 7], [0, 4, 5, 7], [0, 4, 6, 7]])
+
+
+def _tetrahedron_counts(corners, energies):
+    """Sum over tetrahedra of the fraction of each tetrahedron with an energy below each of ``energies``.
+
+    This is the integrated density of states of the linear tetrahedron method (Blöchl et al., PRB 49, 16223).
+    Only the energies between the lowest and highest corner of a tetrahedron need the interpolation formulas;
+    the tetrahedra fully below an energy are counted with a cumulative sum.
+
+    :param corners: the (ntetra, 4) energies of the corners, sorted along the last axis.
+    """
+    e1, e2, e3, e4 = corners.T
+    first, last = np.searchsorted(energies, e1), np.searchsorted(energies, e4)
+    counts = np.cumsum(np.bincount(last, minlength=len(energies) + 1)[:len(energies)]).astype(np.float64)
+    spans = last - first
+    tetra = np.repeat(np.arange(len(corners)), spans)
+    points = np.arange(len(tetra)) - np.repeat(np.cumsum(spans) - spans, spans) + first[tetra]
+    e = energies[points]
+    e1, e2, e3, e4 = e1[tetra], e2[tetra], e3[tetra], e4[tetra]
+    fraction = np.empty_like(e)
+    # the denominators are positive whenever the corresponding interval is not empty
+    case = e < e2
+    d = e[case] - e1[case]
+    fraction[case] = d**3 / ((e2 - e1) * (e3 - e1) * (e4 - e1))[case]
+    case = (e >= e2) & (e < e3)
+    d = e[case] - e2[case]
+    e21, e31, e41, e32, e42 = (x[case] for x in (e2 - e1, e3 - e1, e4 - e1, e3 - e2, e4 - e2))
+    fraction[case] = (e21**2 + 3 * e21 * d + 3 * d**2 - (e31 + e42) / (e32 * e42) * d**3) / (e31 * e41)
+    case = e >= e3
+    d = e4[case] - e[case]
+    fraction[case] = 1 - d**3 / ((e4 - e1) * (e4 - e2) * (e4 - e3))[case]
+    counts += np.bincount(points, weights=fraction, minlength=len(energies))
+    return counts
+
+
+def _tetrahedron_chunks(corners, energies, max_bytes):
+    """Split the tetrahedra into slices whose work arrays in `_tetrahedron_counts` fit in ``max_bytes``.
+
+    The work arrays hold one value per tetrahedron and per energy between its lowest and highest corner, so the
+    size of a slice depends on the spread of its tetrahedra, not only on their number. A single tetrahedron
+    is always a slice, even if it does not fit.
+
+    :param corners: the (ntetra, 4) energies of the corners, sorted along the last axis.
+    :return: the list of slices of ``corners``.
+    """
+    spans = np.searchsorted(energies, corners[:, 3]) - np.searchsorted(energies, corners[:, 0])
+    # one more value per tetrahedron for the arrays over the tetrahedra themselves
+    sizes = np.cumsum(spans + 1) * TETRAHEDRON_WORK_ARRAYS * 8
+    slices = []
+    start = 0
+    while start < len(corners):
+        offset = sizes[start - 1] if start else 0
+        stop = max(int(np.searchsorted(sizes, offset + max_bytes, side='right')), start + 1)
+        slices.append(slice(start, stop))
+        start = stop
+    return slices
+
+
+def _slab_tetrahedra(lower, upper):
+    """Return the sorted corner energies of the tetrahedra between two periodic planes of eigenvalues (n2, n3, nw)."""
+    cube = [
+        np.roll(plane, shift=(-dy, -dz), axis=(0, 1))
+        for plane in (lower, upper)
+        for dy in (0, 1)
+        for dz in (0, 1)
+    ]
+    cube = np.stack(cube).reshape(8, -1)
+    return np.sort(cube[CUBE_TETRAHEDRA].transpose(0, 2, 1).reshape(-1, 4), axis=1)
+
+
+def energy_window(model, mesh=(8, 8, 8), margin=1.0):
+    """Estimate the range of the bands from a coarse mesh, extended by ``margin`` (eV)."""
+    kpoints = np.concatenate([monkhorst_pack_plane(mesh, i) for i in range(mesh[0])])
+    values = eigenvalues(model, kpoints)
+    return values.min() - margin, values.max() + margin
+
+
+def compute_dos(model, mesh, energies=None, sigma=0.05, spin_degeneracy=2, max_bytes=TB_CHUNK_BYTES,
+                max_workers=None):
+    """Compute the density of states on a Monkhorst-Pack mesh with the linear tetrahedron method and with
+    Gaussian broadening.
+
+    The mesh is processed one plane at a time: the eigenvalues of the next planes are computed in a pool
+    of threads (the linear algebra releases the GIL), while the tetrahedra between two consecutive planes
+    and the histogram of the eigenvalues are accumulated, so that the memory used is bounded by the size of
+    a few planes and by ``max_bytes``, whatever the size of the mesh.
+
+    :param mesh: the number of k-points (n1, n2, n3) along each reciprocal lattice vector.
+    :param energies: the energy grid (eV), by default 4001 points over :func:`energy_window`.
+    :param sigma: the standard deviation (eV) of the Gaussian broadening.
+    :return: a dict with the ``energies``, and for ``tetrahedron`` and ``gaussian`` the ``dos``
+        (states/eV/cell) and the ``integrated`` density of states (states/cell).
+    """
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+    from itertools import islice
+
+    if energies is None:
+        energies = np.linspace(*energy_window(model), 4001)
+    energies = np.asarray(energies, dtype=np.float64)
+    step = energies[1] - energies[0]
+    max_workers = max_workers or os.cpu_count() or 1
+    n1, n2, n3 = mesh
+    num_wann = model['hamiltonian'].shape[1]
+    weight = spin_degeneracy / (n1 * n2 * n3)
+
+    def plane_eigenvalues(index):
+        return eigenvalues(model, monkhorst_pack_plane(mesh, index), max_bytes // max_workers).reshape(n2, n3, num_wann)
+
+    tetrahedron = np.zeros(len(energies))
+    histogram = np.zeros(len(energies) + 2)
+
+    def accumulate(lower, upper):
+        corners = _slab_tetrahedra(lower, upper)
+        for chunk in _tetrahedron_chunks(corners, energies, max_bytes):
+            tetrahedron[:] += _tetrahedron_counts(corners[chunk], energies)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        planes = iter(range(n1))
+        pending = deque(executor.submit(plane_eigenvalues, index) for index in islice(planes, max_workers))
+        first = previous = None
+        while pending:
+            plane = pending.popleft().result()
+            for index in islice(planes, 1):
+                pending.append(executor.submit(plane_eigenvalues, index))
+            # the bins below and above the energy grid are the first and the last ones
+            bins = np.clip(np.rint((plane.ravel() - energies[0]) / step).astype(int) + 1, 0, len(energies) + 1)
+            histogram += np.bincount(bins, minlength=len(energies) + 2)
+            if previous is None:
+                first = plane
+            else:
+                accumulate(previous, plane)
+            previous = plane
+        # the mesh is periodic along the first axis too
+        accumulate(previous, first)
+
+    integrated = tetrahedron * weight / 6
+    x = np.arange(-int(np.ceil(5 * sigma / step)), int(np.ceil(5 * sigma / step)) + 1) * step
+    kernel = np.exp(-x**2 / (2 * sigma**2))
+    kernel /= kernel.sum()
+    smeared = np.convolve(histogram[1:-1], kernel, mode='same') * weight
+    return {
+        'energies': energies,
+        'tetrahedron': {'dos': np.gradient(integrated, energies), 'integrated': integrated},
+        'gaussian': {'dos': smeared / step, 'integrated': histogram[0] * weight + np.cumsum(smeared)},
+    }
+
+
+def fermi_level(energies, integrated, nelectrons, tol=1e-8):
+    """Solve N(E_F) = ``nelectrons`` by bisection on the integrated density of states (linearly interpolated)."""
+    low, high = energies[0], energies[-1]
+    if not integrated[0] <= nelectrons <= integrated[-1]:
+        raise ValueError(f'{nelectrons} electrons are outside the range of the integrated density of states')
+    while high - low > tol:
+        middle = 0.5 * (low + high)
+        if np.interp(middle, energies, integrated) < nelectrons:
+            low = middle
+        else:
+            high = middle
+    return 0.5 * (low + high)
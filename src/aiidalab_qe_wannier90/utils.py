@@ -1,40 +1,363 @@
+import io
+import json
+import re
+from pathlib import Path
 from aiida import orm
 import numpy as np
+from ase import Atoms
 from ase.io import read
 from skimage import measure
+from .cache import atomic_write, get_cache_dir, get_object_key
 
-def read_xsf_density(folder: orm.FolderData, filename: str):
+XSF_GRID_BEGIN = 'BEGIN_DATAGRID_3D'
+XSF_GRID_END = 'END_DATAGRID_3D'
+XSF_CHUNK_SIZE = 4 * 1024**2  # characters
 
-    with folder.open(filename, 'r') as f:
-        atoms = read(f, format='xsf')
-        lines = f.readlines()
-    for i, line in enumerate(lines):
-        if 'BEGIN_DATAGRID_3D' in line:
-            grid_start = i + 1
-            break
-    nx, ny, nz = map(int, lines[grid_start].split())
-    origin = np.array([float(x) for x in lines[grid_start + 1].split()])
-    lattice_vectors = np.array([list(map(float, lines[grid_start + j].split())) for j in range(2, 5)])
-    density_data = []
-    for line in lines[grid_start + 5:]:
-        if 'END_DATAGRID_3D' in line:
+
+class _ChunkReader:
+    """Read a text stream in fixed-size chunks, with support for pushing back unconsumed text."""
+
+    def __init__(self, handle, chunk_size):
+        self.handle = handle
+        self.chunk_size = chunk_size
+        self.buffer = ''
+
+    def read(self):
+        if self.buffer:
+            chunk, self.buffer = self.buffer, ''
+            return chunk
+        return self.handle.read(self.chunk_size)
+
+    def unread(self, text):
+        self.buffer = text + self.buffer
+
+    def readline(self):
+        line = ''
+        while True:
+            chunk = self.read()
+            if not chunk:
+                return line
+            end = chunk.find('\n')
+            if end != -1:
+                self.unread(chunk[end + 1:])
+                return line + chunk[:end + 1]
+            line += chunk
+
+
+def _read_datagrid_values(reader, shape, dtype, periodic, stride):
+    """Parse the values of a datagrid chunk by chunk into a preallocated array.
+
+    Only the values kept after removing the periodic duplicate edge and downsampling with ``stride``
+    are stored, so the peak memory is the size of the returned array plus one chunk.
+    """
+    nx, ny, nz = shape
+    size = [(n - 1 if periodic else n) for n in shape]
+    out_shape = [-(-n // stride) for n in size]
+    out = np.empty(int(np.prod(out_shape)), dtype=dtype)
+    direct = stride == 1 and not periodic
+    count = nx * ny * nz
+    position = 0
+    remainder = ''
+    while True:
+        chunk = reader.read()
+        text = remainder + chunk
+        end = text.find(XSF_GRID_END)
+        if end != -1:
+            reader.unread(text[end:])
+            text, remainder = text[:end], ''
+        elif chunk:
+            # keep the last, possibly incomplete, token for the next chunk
+            cut = max(text.rfind(' '), text.rfind('\n'))
+            if cut == -1:
+                remainder = text
+                continue
+            text, remainder = text[:cut], text[cut:]
+        # np.fromstring parses a whitespace-only string as [-1]
+        values = np.fromstring(text, dtype=dtype, sep=' ') if not text.isspace() else np.empty(0, dtype)
+        n = min(values.size, count - position)
+        if direct:
+            out[position:position + n] = values[:n]
+        elif n > 0:
+            # XSF stores the x index fastest
+            flat = np.arange(position, position + n)
+            i, j, k = flat % nx, flat // nx % ny, flat // (nx * ny)
+            keep = (i < size[0]) & (j < size[1]) & (k < size[2]) & (i % stride == 0) & (j % stride == 0) & (
+                k % stride == 0
+            )
+            out_index = i[keep] // stride + out_shape[0] * (j[keep] // stride + out_shape[1] * (k[keep] // stride))
+            out[out_index] = values[:n][keep]
+        position += values.size
+        if end != -1 or not chunk:
             break
-        density_data.extend(map(float, line.split()))
-    expected_size = nx * ny * nz
-    actual_size = len(density_data)
-    if actual_size != expected_size:
-        raise ValueError(f'Mismatch in density data size: expected {expected_size}, got {actual_size}')
-    density_array = np.array(density_data).reshape((nz, ny, nx), order='F')
-    return atoms, nx, ny, nz, origin, lattice_vectors, density_array
+    if position != count:
+        raise ValueError(f'Mismatch in density data size: expected {count}, got {position}')
+    return out.reshape(out_shape, order='F')
+
+
+def parse_xsf(handle, dtype=np.float64, periodic=False, stride=1, chunk_size=XSF_CHUNK_SIZE):
+    """Parse the atoms and all the 3D datagrids of an XSF file in a single streaming pass.
+
+    The file is read in chunks of ``chunk_size`` characters, that are converted in bulk into a
+    preallocated NumPy array of ``dtype``, so the whole file is never held in memory.
+
+    :param handle: a text handle of the XSF file, e.g. from ``FolderData.open``.
+    :param dtype: the dtype of the returned datagrids, e.g. ``np.float32`` to halve the memory.
+    :param periodic: if True, drop the last point along each axis. XSF general grids repeat the
+        first point at the periodic boundary, so the remaining grid spans the cell exactly.
+    :param stride: keep one point every ``stride`` points along each axis, to downsample on the fly.
+    :return: the ``ase.Atoms`` and a list of datagrids, each a dict with the ``name``, ``shape``,
+        ``origin``, ``lattice_vectors`` and ``data`` of the grid. ``data`` has shape ``(nx, ny, nz)``.
+    """
+    reader = _ChunkReader(handle, chunk_size)
+    header = []
+    line = reader.readline()
+    while line and 'BEGIN_BLOCK_DATAGRID_3D' not in line and XSF_GRID_BEGIN not in line:
+        header.append(line)
+        line = reader.readline()
+    atoms = read(io.StringIO(''.join(header)), format='xsf')
+
+    grids = []
+    while line:
+        if XSF_GRID_BEGIN in line:
+            name = line.strip().replace(XSF_GRID_BEGIN, '', 1).strip('_ ')
+            # grid dimensions, origin and the three spanning vectors
+            lines = []
+            while len(lines) < 5:
+                next_line = reader.readline()
+                if not next_line:
+                    raise ValueError(f'Incomplete header for datagrid {name}')
+                if next_line.strip():
+                    lines.append(next_line)
+            shape = tuple(map(int, lines[0].split()))
+            data = _read_datagrid_values(reader, shape, dtype, periodic, stride)
+            grids.append({
+                'name': name,
+                'shape': data.shape,
+                'origin': np.array(lines[1].split(), dtype=float),
+                'lattice_vectors': np.array([line.split() for line in lines[2:5]], dtype=float),
+                'data': data,
+            })
+        line = reader.readline()
+    return atoms, grids
+
+
+def read_xsf_density(folder: orm.FolderData, filename: str, dtype=np.float64, periodic=False, index=0, stride=1):
+    """Read the atoms and one datagrid of an XSF file stored in ``folder``, streaming it from the repository.
+
+    :param index: the index of the datagrid to return, if the file contains several of them.
+    :param stride: keep one point every ``stride`` points along each axis.
+    """
+    with folder.open(filename, 'r') as f:
+        atoms, grids = parse_xsf(f, dtype=dtype, periodic=periodic, stride=stride)
+    if not grids:
+        raise ValueError(f'No {XSF_GRID_BEGIN} block found in {filename}')
+    grid = grids[index]
+    nx, ny, nz = grid['shape']
+    return atoms, nx, ny, nz, grid['origin'], grid['lattice_vectors'], grid['data']
+
+
+GRID_CACHE_VERSION = 2
+
+
+def _grid_cache_paths(folder: orm.FolderData, filename: str, compress=False):
+    stem = get_cache_dir('grids', folder.uuid) / Path(filename).stem
+    return stem.with_suffix('.npz' if compress else '.npy'), stem.with_suffix('.json')
+
+
+def cache_xsf_grid(folder: orm.FolderData, filename: str, dtype=np.float32, compress=False):
+    """Convert an XSF file into a compact binary grid stored in the local cache.
+
+    The datagrid is saved as a ``.npy`` file, that can later be memory-mapped, or as a compressed
+    ``.npz`` file if ``compress`` is True. The origin, the lattice vectors, the atoms, the default
+    isovalue, the isovalue index (see :func:`build_isovalue_index`) and the repository key of the
+    source file are stored in a JSON file next to it.
+
+    :return: the paths of the grid and of the metadata file.
+    """
+    grid_path, meta_path = _grid_cache_paths(folder, filename, compress)
+    key = get_object_key(folder, filename)
+    if grid_path.exists() and meta_path.exists():
+        metadata = json.loads(meta_path.read_text())
+        if (metadata.get('version'), metadata.get('key'), metadata.get('dtype')) == (
+            GRID_CACHE_VERSION, key, np.dtype(dtype).str
+        ):
+            return grid_path, meta_path
+
+    atoms, nx, ny, nz, origin, lattice_vectors, data = read_xsf_density(folder, filename, dtype=dtype, periodic=True)
+    with atomic_write(grid_path) as f:
+        if compress:
+            np.savez_compressed(f, data=data)
+        else:
+            np.save(f, np.ascontiguousarray(data))
+    metadata = {
+        'version': GRID_CACHE_VERSION,
+        'key': key,
+        'dtype': np.dtype(dtype).str,
+        'shape': [nx, ny, nz],
+        'origin': origin.tolist(),
+        'lattice_vectors': lattice_vectors.tolist(),
+        'atoms': {
+            'numbers': atoms.numbers.tolist(),
+            'positions': atoms.positions.tolist(),
+            'cell': atoms.cell.tolist(),
+            'pbc': atoms.pbc.tolist(),
+        },
+        'isovalue': abs(float(find_isovalue(data))),
+        'isovalue_index': {key: value.tolist() for key, value in build_isovalue_index(data).items()},
+    }
+    with atomic_write(meta_path, 'w') as f:
+        json.dump(metadata, f)
+    return grid_path, meta_path
+
+
+def load_xsf_grid(folder: orm.FolderData, filename: str, dtype=np.float32, compress=False):
+    """Load a datagrid from the binary cache, converting the XSF file on first access.
+
+    Uncompressed grids are memory-mapped (copy-on-write), so that only the pages that are used are read.
+    The return value has the same layout as :func:`read_xsf_density` with ``periodic=True``.
+    """
+    grid_path, meta_path = cache_xsf_grid(folder, filename, dtype=dtype, compress=compress)
+    metadata = json.loads(meta_path.read_text())
+    if compress:
+        with np.load(grid_path) as npz:
+            data = npz['data']
+    else:
+        data = np.load(grid_path, mmap_mode='c')
+    atoms = Atoms(**metadata['atoms'])
+    nx, ny, nz = metadata['shape']
+    return atoms, nx, ny, nz, np.array(metadata['origin']), np.array(metadata['lattice_vectors']), data
+
+
+def analyse_wannier_function(density_array, origin, lattice_vectors):
+    """Compute real-space diagnostics of a Wannier function from its (periodic) grid.
+
+    All quantities are computed from vectorized reductions of |ψ|² and of its marginals along the axes.
+
+    :return: a dict with the ``norm`` (∫|ψ|² dV), the ``centre`` of |ψ|² (Å), the ``second_moment``
+        ⟨r²⟩ - ⟨r⟩² of |ψ|² (Å²) and the ``sign_balance`` (positive minus negative weight, over the total).
+    """
+    lattice_vectors = np.asarray(lattice_vectors, dtype=float)
+    weights = np.square(density_array, dtype=np.float64)
+    total = weights.sum()
+    positive = weights[np.asarray(density_array) > 0].sum()
+    # fractional coordinates of the grid points along each axis
+    frac = [np.arange(n) / n for n in weights.shape]
+    marginals = [weights.sum(axis=(1, 2)), weights.sum(axis=(0, 2)), weights.sum(axis=(0, 1))]
+    pairs = {(0, 1): weights.sum(axis=2), (0, 2): weights.sum(axis=1), (1, 2): weights.sum(axis=0)}
+    mean = np.array([marginals[a] @ frac[a] for a in range(3)]) / total
+    moments = np.diag([marginals[a] @ frac[a] ** 2 for a in range(3)])
+    for (a, b), marginal in pairs.items():
+        moments[a, b] = moments[b, a] = frac[a] @ marginal @ frac[b]
+    covariance = moments / total - np.outer(mean, mean)
+    volume = abs(np.linalg.det(lattice_vectors))
+    return {
+        'norm': float(total * volume / weights.size),
+        'centre': (np.asarray(origin) + mean @ lattice_vectors).tolist(),
+        'second_moment': float(np.sum(covariance * (lattice_vectors @ lattice_vectors.T))),
+        'sign_balance': float((2 * positive - total) / total),
+    }
+
+# Worker processes of analyse_wannier_functions: each one loads the profile and opens its own connection
+# to the database, so their number does not follow the number of CPUs
+ANALYSIS_WORKERS = 4
+
+def _init_analysis_worker(profile_name):
+    from aiida import load_profile
+
+    load_profile(profile_name, allow_switch=True)
+
+def _analyse_xsf_grid(folder, filename):
+    _, _, _, _, origin, lattice_vectors, density_array = load_xsf_grid(folder, filename)
+    return analyse_wannier_function(density_array, origin, lattice_vectors)
+
+def _analyse_xsf_file(uuid, filename):
+    return _analyse_xsf_grid(orm.load_node(uuid), filename)
+
+def analyse_wannier_functions(folder: orm.FolderData, max_workers=ANALYSIS_WORKERS):
+    """Compute :func:`analyse_wannier_function` for all the XSF files of ``folder`` in a pool of processes.
+
+    Each worker loads its grids through the binary grid cache, which is filled on the way.
+
+    :param max_workers: the maximum number of worker processes.
+
+    :return: a dict mapping the XSF filenames to their diagnostics.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    from aiida import get_profile
+
+    filenames = sorted(name for name in folder.list_object_names() if name.endswith('.xsf'))
+    if len(filenames) < 2 or not folder.is_stored:
+        return {filename: _analyse_xsf_grid(folder, filename) for filename in filenames}
+    with ProcessPoolExecutor(
+        max_workers=min(max_workers, len(filenames)),
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_analysis_worker,
+        initargs=(get_profile().name,),
+    ) as executor:
+        results = executor.map(_analyse_xsf_file, [folder.uuid] * len(filenames), filenames)
+        return dict(zip(filenames, results))
 
 def find_isovalue(density_array, percentile=90):
     """Find the isovalue for the isosurface by taking the 90th percentile of the density values """
 
     return np.percentile(density_array, percentile)
 
-def compute_isosurface(density_array, isovalue, origin, lattice_vectors, step_size=1):
+ISOVALUE_INDEX_SIZE = 1024
+
+def build_isovalue_index(density_array, size=ISOVALUE_INDEX_SIZE):
+    """Build a compact index of the distribution of |ψ|, to choose isovalues by enclosed density.
+
+    The magnitudes |ψ| are sorted in decreasing order and the cumulative fraction of |ψ|² is sampled
+    at ``size`` evenly spaced fractions. The isosurface at isovalue ``magnitudes[i]`` then encloses
+    (in both lobes) the fraction ``fractions[i]`` of the density.
+
+    :return: a dict with the decreasing ``magnitudes`` and the increasing ``fractions``.
+    """
+    magnitudes = np.sort(np.abs(np.asarray(density_array, dtype=np.float32)).ravel())[::-1]
+    fractions = np.cumsum(np.square(magnitudes, dtype=np.float64))
+    if fractions[-1] > 0:
+        fractions /= fractions[-1]
+    positions = np.searchsorted(fractions, np.linspace(0, 1, size)).clip(max=magnitudes.size - 1)
+    return {'magnitudes': magnitudes[positions].astype(np.float64), 'fractions': fractions[positions]}
 
-    verts, faces, _, _ = measure.marching_cubes(density_array, level=isovalue, step_size=step_size)
+def isovalue_from_fraction(index, fraction):
+    """Return the isovalue whose isosurface encloses ``fraction`` of the density, in O(log n)."""
+    return float(np.interp(fraction, index['fractions'], index['magnitudes']))
+
+def fraction_from_isovalue(index, isovalue):
+    """Return the fraction of the density enclosed by the isosurface at ``isovalue``."""
+    return float(np.interp(-abs(isovalue), -index['magnitudes'], index['fractions']))
+
+def compute_isosurface(density_array, isovalue, origin, lattice_vectors, step_size=1, block_size=None):
+    """Compute the isosurface of a grid with marching cubes.
+
+    :param step_size: the step size in voxels, larger steps give coarser meshes that are faster to compute.
+    :param block_size: if given, the grid is processed in slabs of ``block_size`` planes along the first
+        axis, which bounds the temporary memory of marching cubes for very large grids.
+    :return: the flattened Cartesian vertices and faces.
+    """
+    nx = density_array.shape[0]
+    if block_size is None or block_size >= nx - 1:
+        verts, faces, _, _ = measure.marching_cubes(density_array, level=isovalue, step_size=step_size)
+    else:
+        # slabs share one plane, and start on a multiple of the step size so that they sample the same grid
+        block_size = max(step_size, block_size - block_size % step_size)
+        verts_list, faces_list = [], []
+        offset = 0
+        for start in range(0, nx - 1, block_size):
+            block = density_array[start:min(start + block_size, nx - 1) + 1]
+            if block.shape[0] < 2 or not block.min() < isovalue < block.max():
+                continue
+            block_verts, block_faces, _, _ = measure.marching_cubes(block, level=isovalue, step_size=step_size)
+            block_verts[:, 0] += start
+            verts_list.append(block_verts)
+            faces_list.append(block_faces + offset)
+            offset += len(block_verts)
+        if not verts_list:
+            raise ValueError('Surface level must be within volume data range.')
+        verts, faces = np.concatenate(verts_list), np.concatenate(faces_list)
     # Convert vertices from grid to Cartesian coordinates
     cartesian_verts = np.dot((verts / np.array(density_array.shape)), lattice_vectors) + origin
     # flatten the vertices and faces
@@ -42,29 +365,212 @@ def compute_isosurface(density_array, isovalue, origin, lattice_vectors, step_si
     faces = faces.flatten()
     return cartesian_verts, faces
 
-def process_xsf_file(folder: orm.FolderData, prefix: str = '', isovalue: float = None):
+def load_wannier_function_grid(folder: orm.FolderData, prefix: str):
+    """Load the grid of the Wannier function ``{prefix}.xsf`` together with its default isovalue and isovalue index.
+
+    ``path`` is the memory-mappable file of the grid in the binary cache, which lets worker processes
+    load the grid without copying it.
+    """
+    atoms, _, _, _, origin, lattice_vectors, density_array = load_xsf_grid(folder, f'{prefix}.xsf')
+    grid_path, meta_path = _grid_cache_paths(folder, f'{prefix}.xsf')
+    metadata = json.loads(meta_path.read_text())
+    return {
+        'atoms': atoms,
+        'origin': origin,
+        'lattice_vectors': lattice_vectors,
+        'density': density_array,
+        'isovalue': metadata['isovalue'],
+        'isovalue_index': {key: np.array(value) for key, value in metadata['isovalue_index'].items()},
+        'path': str(grid_path),
+    }
+
+def compute_isosurface_from_file(grid_path, isovalue, origin, lattice_vectors, step_size=1, block_size=None):
+    """Compute an isosurface of a grid stored as a ``.npy`` file, e.g. in a worker process."""
+    density_array = np.load(grid_path, mmap_mode='c')
+    return compute_isosurface(density_array, isovalue, origin, lattice_vectors, step_size, block_size)
 
-    data = {}
+def compute_wannier_function_mesh(grid: dict, prefix: str, isovalue: float, step_size=1, block_size=None,
+                                  executor=None):
+    """Compute the positive and negative isosurfaces of a grid loaded with :func:`load_wannier_function_grid`.
+
+    :param executor: if given, e.g. a ``ProcessPoolExecutor``, the two lobes are computed in parallel
+        in the executor, which loads the grid from its cache file.
+    """
+    levels = (('positive', isovalue), ('negative', -isovalue))
+    if executor is not None and grid.get('path'):
+        futures = [
+            executor.submit(
+                compute_isosurface_from_file, grid['path'], level, grid['origin'], grid['lattice_vectors'],
+                step_size, block_size,
+            )
+            for _, level in levels
+        ]
+        results = [future.result() for future in futures]
+    else:
+        results = [
+            compute_isosurface(
+                grid['density'], level, grid['origin'], grid['lattice_vectors'], step_size=step_size,
+                block_size=block_size,
+            )
+            for _, level in levels
+        ]
     mesh_data = {}
-    try:
-        key = prefix
-        filename = f'{prefix}.xsf'
-        atoms, nx, ny, nz, origin, lattice_vectors, density_array = read_xsf_density(folder, filename)
-        data['atoms'] = atoms
-        if isovalue is None:
-            isovalue = abs(find_isovalue(density_array))
-        data['isovalue'] = isovalue
-        verts, faces = compute_isosurface(density_array, isovalue, origin, lattice_vectors)
-        verts_neg, faces_neg = compute_isosurface(density_array, -isovalue, origin, lattice_vectors)
+    for (sign, _), (verts, faces) in zip(levels, results):
         # the verts is in a nx, ny, nz grid, we need to transform it to fractional coordinates
         # then to cartesian coordinates using the lattice vectors
-        mesh_data[f'{key}_positive_vertices'] = verts
-        mesh_data[f'{key}_positive_faces'] = faces
-        mesh_data[f'{key}_negative_vertices'] = verts_neg
-        mesh_data[f'{key}_negative_faces'] = faces_neg
-        data['mesh_data'] = mesh_data
-    except Exception as e:
-        print(f'Error processing xsf file {filename}: {e}')
+        mesh_data[f'{prefix}_{sign}_vertices'] = verts
+        mesh_data[f'{prefix}_{sign}_faces'] = faces
+    return mesh_data
+
+def weld_mesh(vertices, faces, decimals=3):
+    """Quantize the vertices of a mesh to ``decimals`` (in Å) and merge the ones that coincide.
+
+    This removes the duplicated vertices, e.g. on the boundaries of the slabs of :func:`compute_isosurface`,
+    and drops the triangles that become degenerate.
+
+    :return: the flattened float32 vertices and uint32 faces.
+    """
+    vertices = np.round(np.asarray(vertices, dtype=np.float64).reshape(-1, 3), decimals)
+    faces = np.asarray(faces).reshape(-1, 3)
+    if len(vertices):
+        vertices, inverse = np.unique(vertices, axis=0, return_inverse=True)
+        faces = inverse.reshape(-1)[faces]
+        faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+    return vertices.astype(np.float32).ravel(), faces.astype(np.uint32).ravel()
+
+def lattice_translations(cell, repetitions=(1, 1, 1)):
+    """Return the translations ``n1 a1 + n2 a2 + n3 a3`` with ``-r_i <= n_i <= r_i``, the origin first."""
+    ranges = [sorted(range(-r, r + 1), key=abs) for r in repetitions]
+    n = np.array(np.meshgrid(*ranges, indexing='ij')).reshape(3, -1).T
+    n = n[np.argsort(np.abs(n).sum(axis=1), kind='stable')]
+    return n @ np.asarray(cell, dtype=float)
+
+def tile_mesh(vertices, faces, translations):
+    """Repeat a mesh at the given Cartesian translations, merged into a single vertex and face buffer.
+
+    This displays the periodic images of a Wannier function without recomputing any isosurface.
+    """
+    vertices = np.asarray(vertices).reshape(-1, 3)
+    faces = np.asarray(faces).reshape(-1, 3)
+    translations = np.asarray(translations, dtype=float).reshape(-1, 3)
+    tiled_vertices = vertices[None, :, :] + translations[:, None, :].astype(vertices.dtype)
+    offsets = np.arange(len(translations), dtype=np.int64)[:, None, None] * len(vertices)
+    tiled_faces = faces[None, :, :] + offsets
+    return tiled_vertices.ravel(), tiled_faces.astype(faces.dtype).ravel()
+
+def encode_mesh(vertices, faces, decimals=3):
+    """Encode a mesh for the ``any_mesh`` settings of ``WeasWidget``.
+
+    The vertices and faces are returned as lists, with the vertices rounded to ``decimals`` to keep their
+    JSON short. They cannot be sent as binary buffers: ``any_mesh`` is a JSON list trait, and the viewer
+    deep-copies its settings through JSON and reads the vertices with ``new Float32Array(vertices)``, so
+    the ``DataView`` of a binary buffer would arrive empty.
+    """
+    return np.round(np.asarray(vertices, dtype=np.float64), decimals).tolist(), np.asarray(faces).tolist()
+
+def load_isosurface_mesh(node: orm.ArrayData, prefix: str, isovalue: float = None, rtol=1e-3):
+    """Load an isosurface precomputed by the workchain.
+
+    :param node: the ``ArrayData`` of one Wannier function in the ``generate_isosurface`` outputs.
+    :param isovalue: the isovalue, if None the default isovalue of the Wannier function is used.
+    :return: a dict with the ``isovalue`` and the ``mesh_data``, in the format of
+        :func:`compute_wannier_function_mesh`, or None if the isovalue is not one of the precomputed ones.
+    """
+    isovalues = node.get_array('isovalues')
+    if isovalue is None:
+        isovalue = node.base.attributes.get('default_isovalue')
+    matches = np.flatnonzero(np.isclose(isovalues, isovalue, rtol=rtol, atol=0))
+    if matches.size == 0:
         return None
+    index = matches[0]
+    mesh_data = {
+        f'{prefix}_{sign}_{item}': node.get_array(f'{sign}_{item}_{index}').flatten()
+        for sign in ('positive', 'negative')
+        for item in ('vertices', 'faces')
+    }
+    return {'isovalue': float(isovalues[index]), 'mesh_data': mesh_data}
+
+
+WOUT_SERIES_VERSION = 1
+WOUT_SERIES_EXTRA = 'aiidalab_qe_wannier90_wout_series'
+_WOUT_DIS_MARKER = '<-- DIS'
+_WOUT_SPRD_MARKER = '<-- SPRD'
+_WOUT_DIS_PATTERN = re.compile(r'^ *\d+ +\S+ +(\S+) +\S+ +\S+ +<-- DIS', re.MULTILINE)
+_WOUT_SPRD_PATTERN = re.compile(r'O_TOT= *(\S+) *<-- SPRD')
+_WOUT_CENTRE_PATTERN = re.compile(
+    r'WF centre and spread +\d+ +\( *([^,\s]+) *, *([^,\s]+) *, *([^)\s]+) *\) +(\S+)'
+)
+
+
+def parse_wout(handle, chunk_size=XSF_CHUNK_SIZE):
+    """Parse the convergence series of a Wannier90 output file in a single streaming pass.
+
+    The file is read in chunks of whole lines, which are scanned with compiled regular expressions;
+    the disentanglement lines, that are all in one section, are only searched between the first
+    and the last ``<-- DIS`` marker of each chunk.
+
+    :return: a dict of NumPy arrays: ``omega_i`` (disentanglement, ``<-- DIS``), ``omega_tot``
+        (wannierisation, ``<-- SPRD``), and the ``centres`` (Å) and ``spreads`` (Å²) of the
+        Wannier functions at each wannierisation step, with shapes (steps, num_wann, 3) and (steps, num_wann).
+    """
+    omega_is, omega_tots, steps, block = [], [], [], []
+    tail = ''
+    while True:
+        chunk = handle.read(chunk_size)
+        text = tail + chunk
+        end = text.rfind('\n') + 1 if chunk else len(text)
+        text, tail = text[:end], text[end:]
+        start = text.find(_WOUT_DIS_MARKER)
+        if start != -1:
+            section = text[text.rfind('\n', 0, start) + 1:text.rfind(_WOUT_DIS_MARKER) + len(_WOUT_DIS_MARKER)]
+            omega_is.extend(_WOUT_DIS_PATTERN.findall(section))
+        omega_tots.extend(_WOUT_SPRD_PATTERN.findall(text))
+        # the centres and spreads printed before a ``<-- SPRD`` line belong to that wannierisation step
+        *segments, last = text.split(_WOUT_SPRD_MARKER)
+        for segment in segments:
+            block.extend(_WOUT_CENTRE_PATTERN.findall(segment))
+            steps.append(block)
+            block = []
+        block.extend(_WOUT_CENTRE_PATTERN.findall(last))
+        if not chunk:
+            break
+    num_wann = len(steps[0]) if steps else 0
+    steps = np.array([step for step in steps if len(step) == num_wann], dtype=float).reshape(-1, num_wann, 4)
+    return {
+        'omega_i': np.array(omega_is, dtype=float),
+        'omega_tot': np.array(omega_tots, dtype=float),
+        'centres': steps[..., :3],
+        'spreads': steps[..., 3],
+    }
+
+
+def get_wout_series(folder: orm.FolderData, filename: str = 'aiida.wout'):
+    """Return the series of :func:`parse_wout`, cached in the extras of ``folder``.
+
+    The cache is keyed by the repository key of the file, so it is refreshed if the file changes.
+    """
+    key = get_object_key(folder, filename)
+    cached = folder.base.extras.get(WOUT_SERIES_EXTRA, None) if folder.is_stored else None
+    if cached and (cached.get('version'), cached.get('key')) == (WOUT_SERIES_VERSION, key):
+        return {name: np.array(value, dtype=float) for name, value in cached['series'].items()}
+    with folder.open(filename) as handle:
+        series = parse_wout(handle)
+    if folder.is_stored:
+        folder.base.extras.set(WOUT_SERIES_EXTRA, {
+            'version': WOUT_SERIES_VERSION,
+            'key': key,
+            'series': {name: value.tolist() for name, value in series.items()},
+        })
+    return series
+
+
+def get_iteration_counts(folder: orm.FolderData, filename: str = 'aiida.wout'):
+    """Return the number of disentanglement and wannierisation iterations of a Wannier90 calculation.
 
-    return data
+    The initial step printed before the first wannierisation iteration is not counted.
+    """
+    series = get_wout_series(folder, filename)
+    return {
+        'dis_iterations': len(series['omega_i']),
+        'wannierise_iterations': max(len(series['omega_tot']) - 1, 0),
+    }
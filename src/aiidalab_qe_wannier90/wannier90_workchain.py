@@ -1,12 +1,146 @@
+from collections.abc import Mapping
+
 import numpy as np
 from aiida import orm
-from aiida.engine import WorkChain, if_
+from aiida.common import AttributeDict
+from aiida.common.links import LinkType
+from aiida.engine import WorkChain, calcfunction, if_, while_
 from aiida_wannier90_workflows.workflows.bands import Wannier90BandsWorkChain
 from aiida_wannier90_workflows.workflows.optimize import Wannier90OptimizeWorkChain
+from aiida_quantumespresso.calculations.functions.seekpath_structure_analysis import seekpath_structure_analysis
 from aiida_quantumespresso.workflows.pw.bands import PwBandsWorkChain
+from aiida_quantumespresso.utils.mapping import prepare_process_inputs
+from aiida_quantumespresso.workflows.pw.base import PwBaseWorkChain
 from aiida_skeaf.workflows import SkeafWorkChain
 from aiida_wannier90_workflows.utils.workflows.builder.setter import set_parallelization
 from aiidalab_qe.utils import enable_pencil_decomposition
+from .optimize import (
+    BAND_DISTANCE_THRESHOLD_MEV,
+    DISPROJ_MAX_RANGE,
+    DISPROJ_MIN_RANGE,
+    analyse_projectability,
+    build_optimize_trace,
+    compute_bands_distance,
+    get_disproj_grid,
+    get_fermi_energy,
+    propose_disproj_points,
+)
+
+# number of (dis_proj_max, dis_proj_min) values of the exhaustive PDWF scan
+NUMBER_OF_DISPROJ_MAX = 15
+NUMBER_OF_DISPROJ_MIN = 2
+# maximum number of Wannier90 calculations running at the same time in the concurrent and adaptive scans
+MAX_CONCURRENT_WANNIERIZATIONS = 6
+
+# isovalues of the precomputed isosurfaces, relative to the default isovalue of each Wannier function
+ISOSURFACE_ISOVALUE_SCALES = [0.5, 1.0, 2.0]
+
+
+@calcfunction
+def compute_isosurfaces(retrieved, isovalue_scales):
+    """Compute the positive and negative isosurfaces of all the Wannier functions in ``retrieved``.
+
+    Returns one ``ArrayData`` per Wannier function, with the ``isovalues`` array and, for the i-th
+    isovalue, the ``positive_vertices_i``, ``positive_faces_i``, ``negative_vertices_i`` and
+    ``negative_faces_i`` arrays. Vertices are stored as float32 and faces as int32. The isovalue index of
+    the function is stored in the ``isovalue_index_magnitudes`` and ``isovalue_index_fractions`` arrays.
+    """
+    from .utils import build_isovalue_index, compute_isosurface, find_isovalue, read_xsf_density
+
+    results = {}
+    for filename in retrieved.list_object_names():
+        if not filename.endswith('.xsf'):
+            continue
+        _, _, _, _, origin, lattice_vectors, density = read_xsf_density(
+            retrieved, filename, dtype=np.float32, periodic=True
+        )
+        default_isovalue = abs(float(find_isovalue(density)))
+        isovalues = np.array(isovalue_scales.get_list()) * default_isovalue
+        mesh = orm.ArrayData()
+        mesh.set_array('isovalues', isovalues)
+        for key, value in build_isovalue_index(density).items():
+            mesh.set_array(f'isovalue_index_{key}', value)
+        for i, isovalue in enumerate(isovalues):
+            for sign, level in (('positive', isovalue), ('negative', -isovalue)):
+                try:
+                    vertices, faces = compute_isosurface(density, level, origin, lattice_vectors)
+                except (ValueError, RuntimeError):
+                    # the isovalue is outside the range of the data
+                    vertices, faces = np.empty(0), np.empty(0)
+                mesh.set_array(f'{sign}_vertices_{i}', vertices.astype(np.float32))
+                mesh.set_array(f'{sign}_faces_{i}', faces.astype(np.int32))
+        mesh.base.attributes.set('default_isovalue', default_isovalue)
+        results[filename[:-len('.xsf')]] = mesh
+    return results
+
+
+def _get_iteration_counts(calc):
+    """Return the number of iterations of a Wannier90 calculation, or an empty dict if they cannot be parsed."""
+    from .utils import get_iteration_counts
+
+    try:
+        return get_iteration_counts(calc.outputs.retrieved)
+    except (AttributeError, FileNotFoundError, OSError):
+        return {}
+
+
+def _get_wannier90_calc(workchain):
+    """Return the Wannier90 calculation of an optimize workchain run without the reference bands."""
+    return workchain.outputs.wannier90.output_parameters.creator
+
+
+def _get_builder_inputs(namespace):
+    """Return the inputs set in a namespace of a process builder as nested dicts, without the empty namespaces.
+
+    The dicts are copies, that can be modified without changing the builder.
+    """
+    inputs = {}
+    for key, value in namespace.items():
+        if isinstance(value, Mapping) and not isinstance(value, orm.Node):
+            value = _get_builder_inputs(value)
+            if not value:
+                continue
+        inputs[key] = value
+    return inputs
+
+
+def _get_calculation_outputs(calc):
+    """Return the outputs of a calculation, nested by namespace, to be attached as outputs of the workchain."""
+    return AttributeDict(calc.base.links.get_outgoing(link_type=LinkType.CREATE).nested())
+
+
+class PwBandsFromScfWorkChain(PwBandsWorkChain):
+    """A `PwBandsWorkChain` that starts from an scf calculation run beforehand, and only runs the bands step.
+
+    The caller can then share the scf with other calculations, while the bands step keeps the logic of the
+    `PwBandsWorkChain` (number of bands, diagonalization, k-points...).
+    """
+
+    @classmethod
+    def define(cls, spec):
+        super().define(spec)
+        spec.input(
+            'scf_parameters',
+            valid_type=orm.Dict,
+            help='The output parameters of the scf calculation to start from.',
+        )
+        spec.outline(
+            cls.setup,
+            if_(cls.should_run_seekpath)(
+                cls.run_seekpath,
+            ),
+            cls.use_scf,
+            cls.run_bands,
+            cls.inspect_bands,
+            cls.results,
+        )
+
+    def use_scf(self):
+        """Use the calculation that created the ``scf_parameters`` as the scf of this workchain"""
+        self.ctx.workchain_scf = self.inputs.scf_parameters.creator
+        return self.inspect_scf()
+
+
 class QeAppWannier90BandsWorkChain(WorkChain):
     """Workchain to run a bands calculation with Quantum ESPRESSO and Wannier90."""
 
@@ -45,12 +179,44 @@ class QeAppWannier90BandsWorkChain(WorkChain):
             },
         )
         spec.output_namespace('generate_isosurface', required=False, dynamic=True)
+        spec.output(
+            'optimize_trace',
+            valid_type=orm.List,
+            required=False,
+            help='The (dis_proj_max, dis_proj_min) points tried by the scan, in order, '
+            'with their bands distance (eV, None if the Wannierization failed).',
+        )
+        spec.output(
+            'projectability_prediction',
+            valid_type=orm.Dict,
+            required=False,
+            help='The PDWF thresholds predicted from the projectabilities, tried first by the scan.',
+        )
 
         spec.outline(cls.setup,
+                     if_(cls.should_run_seekpath)(
+                         cls.run_seekpath,
+                        ),
+                     cls.run_scf,
+                     cls.inspect_scf,
                      cls.run_bands,
                      cls.inspect_pw_bands,
-                     cls.run_optimize,
                      cls.inspect_optimize,
+                     while_(cls.should_run_scan)(
+                         cls.run_scan,
+                         cls.inspect_scan,
+                        ),
+                     if_(cls.should_run_localise)(
+                         cls.run_localise,
+                         cls.inspect_localise,
+                        ),
+                     if_(cls.should_run_plot)(
+                         cls.run_plot,
+                        ),
+                     cls.results_optimize,
+                     if_(cls.should_generate_isosurface)(
+                         cls.run_generate_isosurface,
+                        ),
                      if_(cls.should_run_skeaf)(
                          cls.run_skeaf,
                          cls.inspect_skeaf
@@ -96,33 +262,120 @@ class QeAppWannier90BandsWorkChain(WorkChain):
 
     def setup(self):
         """Define the current workchain"""
-        pass
+        overrides = self.inputs.overrides.get('wannier90_bands', {}) if 'overrides' in self.inputs else {}
+        wannier90_parameters = overrides.get('wannier90_parameters', {})
+        if wannier90_parameters.get('scan_pdwf_parameter', False):
+            # after the first point, run by the `Wannier90OptimizeWorkChain`, the other ones are run
+            # 'serial': one after the other, in the order of the exhaustive scan
+            # 'concurrent': as concurrent calculations, in the order of the exhaustive scan
+            # 'adaptive': as concurrent calculations, chosen from the bands distances found so far
+            self.ctx.scan_mode = wannier90_parameters.get('scan_mode', 'serial')
+        else:
+            self.ctx.scan_mode = None
+        self.ctx.disproj_grid = get_disproj_grid(
+            wannier90_parameters.get('number_of_disproj_max', NUMBER_OF_DISPROJ_MAX),
+            wannier90_parameters.get('number_of_disproj_min', NUMBER_OF_DISPROJ_MIN),
+        )
+        if self.ctx.scan_mode == 'serial':
+            self.ctx.max_concurrent = 1
+        else:
+            self.ctx.max_concurrent = wannier90_parameters.get(
+                'max_concurrent_wannierizations', MAX_CONCURRENT_WANNIERIZATIONS
+            )
+        # only disentangle the scan points, and localise the best one restarting from its checkpoint
+        self.ctx.scan_warm_start = wannier90_parameters.get('scan_warm_start', False)
+        self.ctx.bands_distance_threshold = (
+            wannier90_parameters.get('bands_distance_threshold', BAND_DISTANCE_THRESHOLD_MEV) / 1000
+        )
+        # as in the `PwBandsWorkChain`, replaced by the output of SeeKpath if the k-points are not given
+        self.ctx.current_structure = self.inputs.structure
+        self.ctx.bands_kpoints = self._get_pw_bands_builder().get('bands_kpoints', None)
 
-    def run_bands(self):
-        """Run the bands workchain"""
+    def _get_pw_bands_builder(self):
+        """Return the builder of the bands step, with the inputs of the `PwBandsWorkChain` protocol.
+
+        It is built once, in ``setup``, and again only if the workchain is reloaded from a checkpoint, since
+        the builder holds unstored nodes that cannot be kept in the context. It must not be modified: the
+        steps submit copies of its inputs, see ``_get_builder_inputs``.
+        """
+        builder = getattr(self, '_pw_bands_builder', None)
+        if builder is not None:
+            return builder
         if 'overrides' in self.inputs:
             overrides = self.inputs.overrides.get('pw_bands', {})
         else:
             overrides = {}
         kwargs = self.inputs.kwargs if 'kwargs' in self.inputs else {}
-        builder = PwBandsWorkChain.get_builder_from_protocol(
+        builder = PwBandsFromScfWorkChain.get_builder_from_protocol(
             code = self.inputs.codes['pw'],
             structure = self.inputs.structure,
             protocol = self.inputs.protocol.value,
             overrides = overrides,
             **kwargs,
         )
-        builder.pop('relax')
-        builder.metadata.call_link_label = 'pw_bands'
+        builder.pop('relax', None)
         if 'parallelization' in self.inputs:
             set_parallelization(
                 builder, self.inputs.parallelization.get_dict(), process_class=PwBandsWorkChain
             )
         enable_pencil_decomposition(builder.scf.pw)
         enable_pencil_decomposition(builder.bands.pw)
-        node = self.submit(builder)
-        self.report(f'submitting `WorkChain` <PK={node.pk}>')
-        self.to_context(**{'pw_bands': node})
+        self._pw_bands_builder = builder
+        return builder
+
+    def should_run_seekpath(self):
+        """As in the `PwBandsWorkChain`, SeeKpath is only run if the `bands_kpoints` are not given"""
+        return self.ctx.bands_kpoints is None
+
+    def run_seekpath(self):
+        """Get the primitive structure and the high-symmetry k-points path with SeeKpath, as `PwBandsWorkChain`"""
+        inputs = {
+            'reference_distance': self._get_pw_bands_builder().get('bands_kpoints_distance', None),
+            'metadata': {'call_link_label': 'seekpath'},
+        }
+        result = seekpath_structure_analysis(self.inputs.structure, **inputs)
+        self.ctx.current_structure = result['primitive_structure']
+        self.ctx.bands_kpoints = result['explicit_kpoints']
+        self.out('pw_bands.primitive_structure', result['primitive_structure'])
+        self.out('pw_bands.seekpath_parameters', result['parameters'])
+
+    def run_scf(self):
+        """Run the scf calculation, on which both the pw bands and the Wannierization depend"""
+        # the exposed namespaces of the builder have no structure port, so work on plain inputs
+        inputs = AttributeDict(_get_builder_inputs(self._get_pw_bands_builder().scf))
+        inputs.setdefault('metadata', {})['call_link_label'] = 'scf'
+        inputs.pw['structure'] = self.ctx.current_structure
+        node = self.submit(PwBaseWorkChain, **prepare_process_inputs(PwBaseWorkChain, inputs))
+        self.report(f'submitting `PwBaseWorkChain` <PK={node.pk}> in scf mode')
+        self.to_context(scf=node)
+
+    def inspect_scf(self):
+        """Inspect the scf calculation"""
+        workchain = self.ctx.scf
+        if not workchain.is_finished_ok:
+            self.report(f'scf PwBaseWorkChain failed with exit status {workchain.exit_status}')
+            return self.exit_codes.ERROR_PW_BANDS_WORKCHAIN_FAILED
+        # with fixed occupations, pw.x only gives the highest occupied level
+        self.ctx.fermi_energy = get_fermi_energy(workchain.outputs.output_parameters)
+
+    def run_bands(self):
+        """Run the pw bands and the Wannierization at the same time.
+
+        The Wannierization only needs the remote folder of the scf calculation, the band structures are
+        compared once both are finished, see ``inspect_optimize``.
+        """
+        inputs = _get_builder_inputs(self._get_pw_bands_builder())
+        inputs.pop('bands_kpoints_distance', None)
+        inputs.update({
+            'structure': self.ctx.current_structure,
+            'bands_kpoints': self.ctx.bands_kpoints,
+            'scf_parameters': self.ctx.scf.outputs.output_parameters,
+        })
+        inputs.setdefault('metadata', {})['call_link_label'] = 'pw_bands'
+        node = self.submit(PwBandsFromScfWorkChain, **inputs)
+        self.report(f'submitting `PwBandsFromScfWorkChain` <PK={node.pk}>')
+        self.to_context(pw_bands=node)
+        self._submit_optimize()
 
     def inspect_pw_bands(self):
         """Inspect the results of the bands workchain"""
@@ -130,53 +383,42 @@ class QeAppWannier90BandsWorkChain(WorkChain):
 
         if not workchain.is_finished_ok:
             self.report('Pw bands workchain failed')
-            return self.exit_codes.ERROR_WORKCHAIN_FAILED
-        else:
-            self.out_many(
-                self.exposed_outputs(
-                    self.ctx['pw_bands'], PwBandsWorkChain, namespace='pw_bands'
-                )
-            )
-            self.report('Pw bands workchain completed successfully')
+            return self.exit_codes.ERROR_PW_BANDS_WORKCHAIN_FAILED
+        self.ctx.reference_bands = workchain.outputs.band_structure
+        self.out_many(
+            self.exposed_outputs(workchain, PwBandsWorkChain, namespace='pw_bands')
+        )
+        self.report('Pw bands workchain completed successfully')
 
-    def run_optimize(self):
-        """Run the optimize workchain"""
-        pw_bands_node = self.ctx.pw_bands
-        if not pw_bands_node.is_finished_ok:
-            self.report('Bands workchain failed')
-            return self.exit_codes.ERROR_WORKCHAIN_FAILED
-        scf_calc = pw_bands_node.outputs.scf_parameters.creator
-        parent_folder = scf_calc.outputs.remote_folder
-        structure = scf_calc.inputs.structure
-        reference_bands = pw_bands_node.outputs.band_structure
-        bands_kpoints = reference_bands.creator.inputs.kpoints
+    def _submit_optimize(self):
+        """Submit the optimize workchain, without the reference bands.
+
+        It runs a single Wannierization, with the thresholds of the first point of the exhaustive scan; the
+        scan, if any, is run by this workchain.
+        """
         if 'overrides' in self.inputs:
             overrides = self.inputs.overrides.get('wannier90_bands', {})
         else:
             overrides = {}
-        wannier90_parameters = overrides.pop('wannier90_parameters', {})
-        scan_pdwf_parameter = wannier90_parameters.pop('scan_pdwf_parameter', False)
-        if scan_pdwf_parameter:
-            number_of_disproj_max = 15
-            number_of_disproj_min = 2
-        else:
-            number_of_disproj_max = 1
-            number_of_disproj_min = 1
-        kwargs_filtered = {k: v for k, v in self.inputs.kwargs.items() if k not in ['compute_fermi_surface', 'fermi_surface_kpoint_distance', 'compute_dhva_frequencies','dHvA_frequencies_parameters']}
+        overrides.pop('wannier90_parameters', {})
+        kwargs_filtered = {k: v for k, v in self.inputs.kwargs.items() if k not in ['compute_fermi_surface', 'fermi_surface_kpoint_distance', 'compute_dhva_frequencies','dHvA_frequencies_parameters', 'generate_isosurface']}
         codes = {key: value for key, value in self.inputs.codes.items()}
         builder = Wannier90OptimizeWorkChain.get_builder_from_protocol(
             codes = codes,
-            structure = structure,
+            structure = self.ctx.current_structure,
             protocol = self.inputs.protocol.value,
-            reference_bands=reference_bands,
-            bands_kpoints=bands_kpoints,
+            bands_kpoints=self.ctx.bands_kpoints,
             overrides=overrides,
             **kwargs_filtered,
         )
-        builder.optimize_disprojmax_range = orm.List(list=list(np.linspace(0.99, 0.85, number_of_disproj_max)))
-        builder.optimize_disprojmin_range = orm.List(list=list(np.linspace(0.01, 0.15, number_of_disproj_min)))
+        builder.optimize_disproj = orm.Bool(False)
+        parameters = builder.wannier90.wannier90.parameters.get_dict()
+        if 'dis_proj_max' in parameters:
+            # only set the thresholds if the frozen states use them
+            parameters.update({'dis_proj_max': DISPROJ_MAX_RANGE[0], 'dis_proj_min': DISPROJ_MIN_RANGE[0]})
+            builder.wannier90.wannier90.parameters = orm.Dict(parameters)
         builder.pop('scf')
-        builder.nscf.pw.parent_folder = parent_folder
+        builder.nscf.pw.parent_folder = self.ctx.scf.outputs.remote_folder
         if 'parallelization' in self.inputs:
             set_parallelization(
                 builder, self.inputs.parallelization.get_dict(), process_class=Wannier90BandsWorkChain
@@ -193,19 +435,343 @@ class QeAppWannier90BandsWorkChain(WorkChain):
         self.to_context(**{'wannier90_bands': node})
 
     def inspect_optimize(self):
-        """Attach the bands results"""
+        """Inspect the optimize workchain, its optimal Wannierization is the best one so far"""
         workchain = self.ctx['wannier90_bands']
 
         if not workchain.is_finished_ok:
             self.report('Optimize workchain failed')
-            return self.exit_codes.ERROR_WORKCHAIN_FAILED
+            return self.exit_codes.ERROR_WANNIER90_BANDS_WORKCHAIN_FAILED
+        self.report('Optimize workchain completed successfully')
+        optimal = _get_wannier90_calc(workchain)
+        self.ctx.optimize_calc = optimal
+        self.ctx.best_calc = None
+        self.ctx.best_bands_distance = self._compute_bands_distance(optimal)
+        # the thresholds of the protocol, that are only set for the projectability-based frozen states
+        disproj_max = optimal.inputs.parameters.get_dict().get('dis_proj_max')
+        disproj_min = optimal.inputs.parameters.get_dict().get('dis_proj_min')
+        self.ctx.trace = [{
+            'dis_proj_max': disproj_max,
+            'dis_proj_min': disproj_min,
+            'bands_distance': self.ctx.best_bands_distance.value if self.ctx.best_bands_distance else None,
+            'pk': optimal.pk,
+            'predicted': False,
+            'localised': True,
+            **_get_iteration_counts(optimal),
+        }]
+        # the bands distance nodes of the trace, by PK of the calculation, for its provenance
+        self.ctx.trace_distances = {}
+        if self.ctx.best_bands_distance is not None:
+            self.ctx.trace_distances[str(optimal.pk)] = self.ctx.best_bands_distance
+        self.ctx.optimize_distance = self.ctx.best_bands_distance
+        self.ctx.scan_points = []
+        # the submitted scan points that have not been inspected yet, oldest first
+        self.ctx.scan_running = []
+        self.ctx.grid_scheduled = False
+        if self.ctx.scan_mode is None or self._is_converged():
+            return
+        if self.ctx.fermi_energy is None:
+            self.report('the scf calculation has no Fermi energy, the bands cannot be compared: skipping the scan')
+            return
+        if self.ctx.scan_warm_start:
+            # the scan points are not localised, they are only compared with each other, and the best one is
+            # compared with the optimal Wannierization once localised
+            self.ctx.best_bands_distance = None
+        if self.ctx.scan_mode == 'adaptive':
+            # start from steps of half the ranges, i.e. the first neighbours are the centre and the other end
+            self.ctx.step_max = abs(DISPROJ_MAX_RANGE[1] - DISPROJ_MAX_RANGE[0]) / 2
+            self.ctx.step_min = abs(DISPROJ_MIN_RANGE[1] - DISPROJ_MIN_RANGE[0]) / 2
+        prediction = self._predict_disproj(workchain)
+        if prediction is not None:
+            # the predicted point is run alone, the scan only falls back if it is not good enough
+            self.out('projectability_prediction', prediction)
+            self.ctx.scan_points = [{**prediction.get_dict(), 'predicted': True}]
+        elif self.ctx.scan_warm_start and self.ctx.scan_mode == 'adaptive' and None not in (disproj_max, disproj_min):
+            # the search starts from the thresholds of the optimal Wannierization, without localisation
+            self.ctx.scan_points = [{'dis_proj_max': disproj_max, 'dis_proj_min': disproj_min}]
         else:
-            self.out_many(
-                self.exposed_outputs(
-                    self.ctx['wannier90_bands'], Wannier90OptimizeWorkChain, namespace='wannier90_bands'
-                )
+            self._update_scan_points()
+
+    def _compute_bands_distance(self, calc):
+        """Compute the bands distance of a Wannier90 calculation with respect to the pw bands.
+
+        :return: the bands distance, or None if the calculation failed or the scf has no Fermi energy.
+        """
+        if self.ctx.fermi_energy is None or not calc.is_finished_ok or 'interpolated_bands' not in calc.outputs:
+            return None
+        return compute_bands_distance(
+            self.ctx.reference_bands,
+            calc.outputs.interpolated_bands,
+            orm.Float(self.ctx.fermi_energy),
+            calc.inputs.parameters,
+        )
+
+    def _predict_disproj(self, workchain):
+        """Predict the PDWF thresholds from the projectabilities computed by the optimize workchain.
+
+        :return: the predicted thresholds, or None if there are no projections or the scf has no Fermi energy.
+        """
+        if 'projwfc' not in workchain.outputs or 'projections' not in workchain.outputs.projwfc:
+            # e.g. spin-polarized calculations, with separate projections for each spin
+            return None
+        if self.ctx.fermi_energy is None:
+            return None
+        prediction = analyse_projectability(workchain.outputs.projwfc.projections, orm.Float(self.ctx.fermi_energy))
+        self.report(
+            f'predicted dis_proj_max={prediction["dis_proj_max"]:.3f}, '
+            f'dis_proj_min={prediction["dis_proj_min"]:.3f}, dis_froz_max={prediction["dis_froz_max"]:.3f} eV '
+            'from the projectabilities'
+        )
+        return prediction
+
+    def _get_scan_trace(self):
+        """Return the points of the trace that can be compared with the scan points.
+
+        With ``scan_warm_start``, the scan points are not localised, unlike the optimal Wannierization.
+        """
+        if not self.ctx.scan_warm_start:
+            return self.ctx.trace
+        return [point for point in self.ctx.trace if not point['localised']]
+
+    def _update_scan_points(self):
+        """Set the next points of the scan, never running more points than the exhaustive scan."""
+        trace = self._get_scan_trace()
+        running = [(item['point']['dis_proj_max'], item['point']['dis_proj_min']) for item in self.ctx.scan_running]
+        if self.ctx.scan_mode == 'adaptive':
+            points, self.ctx.step_max, self.ctx.step_min = propose_disproj_points(
+                trace, self.ctx.step_max, self.ctx.step_min, pending=running,
+                max_points=len(self.ctx.disproj_grid) - len(trace) - len(running),
             )
-            self.report('Optimize workchain completed successfully')
+        elif not self.ctx.scan_points and not self.ctx.grid_scheduled:
+            evaluated = [(point['dis_proj_max'], point['dis_proj_min']) for point in trace] + running
+            points = [point for point in self.ctx.disproj_grid if point not in evaluated]
+            self.ctx.grid_scheduled = True
+        else:
+            return
+        self.ctx.scan_points = [
+            {'dis_proj_max': disproj_max, 'dis_proj_min': disproj_min} for disproj_max, disproj_min in points
+        ]
+
+    def _is_converged(self):
+        distance = self.ctx.best_bands_distance
+        return distance is not None and distance.value <= self.ctx.bands_distance_threshold
+
+    def should_run_scan(self):
+        return bool(self.ctx.scan_points or self.ctx.scan_running) and not self._is_converged()
+
+    def run_scan(self):
+        """Keep up to ``max_concurrent`` scan points running as Wannier90 calculations, and wait for the oldest.
+
+        All the points restart from the optimal Wannierization of the optimize workchain, in particular from
+        the remote folder with the matrices computed by pw2wannier90, and only change its thresholds: each
+        point runs with the original inputs and the thresholds it is reported with.
+        """
+        base = self.ctx.optimize_calc
+        free = max(0, self.ctx.max_concurrent - len(self.ctx.scan_running))
+        batch, self.ctx.scan_points = self.ctx.scan_points[:free], self.ctx.scan_points[free:]
+        for point in batch:
+            builder = base.get_builder_restart()
+            parameters = builder.parameters.get_dict()
+            parameters.update({'dis_proj_max': point['dis_proj_max'], 'dis_proj_min': point['dis_proj_min']})
+            if self.ctx.scan_warm_start:
+                parameters['num_iter'] = 0
+            # only the best point is plotted, by `run_plot`
+            parameters['wannier_plot'] = False
+            if 'dis_froz_max' in point and 'dis_froz_max' in parameters:
+                # only lower the upper bound of the energy window, if the frozen states use one
+                parameters['dis_froz_max'] = min(parameters['dis_froz_max'], point['dis_froz_max'])
+            builder.parameters = orm.Dict(parameters)
+            options = builder.metadata.options
+            options.additional_retrieve_list = [
+                pattern for pattern in options.get('additional_retrieve_list', []) if not pattern.endswith('.xsf')
+            ]
+            builder.metadata.call_link_label = 'wannier90_scan'
+            node = self.submit(builder)
+            self.report(
+                f'submitting `Wannier90Calculation` <PK={node.pk}> with '
+                f'dis_proj_max={point["dis_proj_max"]:.3f}, dis_proj_min={point["dis_proj_min"]:.3f}'
+            )
+            self.ctx.scan_running.append({'pk': node.pk, 'point': point})
+        self.to_context(scan_next=orm.load_node(self.ctx.scan_running[0]['pk']))
+
+    def inspect_scan(self):
+        """Compute the bands distance of the scan points that are finished, and keep the best one.
+
+        Once the bands distance is below the threshold, the scan points still running are killed and ignored.
+        """
+        finished = [item for item in self.ctx.scan_running if orm.load_node(item['pk']).is_terminated]
+        self.ctx.scan_running = [item for item in self.ctx.scan_running if item not in finished]
+        for item in finished:
+            calc, scan_point = orm.load_node(item['pk']), item['point']
+            point = {
+                'dis_proj_max': scan_point['dis_proj_max'],
+                'dis_proj_min': scan_point['dis_proj_min'],
+                'bands_distance': None,
+                'pk': calc.pk,
+                'predicted': scan_point.get('predicted', False),
+                'localised': not self.ctx.scan_warm_start,
+            }
+            self.ctx.trace.append(point)
+            distance = self._compute_bands_distance(calc)
+            if distance is None:
+                self.report(f'Wannier90Calculation <PK={calc.pk}> failed, skipping it')
+                continue
+            point.update(_get_iteration_counts(calc))
+            point['bands_distance'] = distance.value
+            self.ctx.trace_distances[str(calc.pk)] = distance
+            if self.ctx.best_bands_distance is None or distance.value < self.ctx.best_bands_distance.value:
+                self.ctx.best_calc = calc
+                self.ctx.best_bands_distance = distance
+        if self._is_converged():
+            self.report(
+                f'bands distance {self.ctx.best_bands_distance.value * 1000:.2f} meV below the threshold, '
+                'stopping the scan'
+            )
+            self._stop_scan()
+        else:
+            self._update_scan_points()
+
+    def _stop_scan(self):
+        """Drop the scan points that are not submitted yet, and kill the running ones, whose results are ignored"""
+        self.ctx.scan_points = []
+        controller = self.runner.controller
+        for item in self.ctx.scan_running:
+            self.report(f'killing `Wannier90Calculation` <PK={item["pk"]}>, the scan is over')
+            if controller is not None:
+                controller.kill_process(item['pk'], 'the PDWF scan reached the bands distance threshold', no_reply=True)
+        self.ctx.scan_running = []
+
+    def should_run_localise(self):
+        return self.ctx.scan_warm_start and self.ctx.best_calc is not None
+
+    def run_localise(self):
+        """Localise the Wannier functions of the best scan point, restarting from its checkpoint.
+
+        The checkpoint already contains the disentangled subspace of the point, so only the wannierisation
+        is run, with the number of iterations of the optimize workchain.
+        """
+        best = self.ctx.best_calc
+        optimal = self.ctx.optimize_calc
+        builder = best.get_builder_restart()
+        parameters = builder.parameters.get_dict()
+        parameters['restart'] = 'wannierise'
+        parameters['num_iter'] = optimal.inputs.parameters.get_dict().get('num_iter', 200)
+        builder.parameters = orm.Dict(parameters)
+        builder.remote_input_folder = best.outputs.remote_folder
+        builder.metadata.call_link_label = 'wannier90_localise'
+        node = self.submit(builder)
+        self.report(f'submitting `Wannier90Calculation` <PK={node.pk}>')
+        self.to_context(wannier90_localise=node)
+
+    def inspect_localise(self):
+        """Compare the localised best scan point with the optimal Wannierization, and keep the best one"""
+        calc = self.ctx.wannier90_localise
+        distance = self._compute_bands_distance(calc)
+        if distance is None:
+            self.report(f'Wannier90Calculation <PK={calc.pk}> failed, keeping the optimal Wannierization')
+            self.ctx.best_calc = None
+            self.ctx.best_bands_distance = self.ctx.optimize_distance
+            return
+        parameters = calc.inputs.parameters.get_dict()
+        self.ctx.trace.append({
+            'dis_proj_max': parameters['dis_proj_max'],
+            'dis_proj_min': parameters['dis_proj_min'],
+            'bands_distance': distance.value,
+            'pk': calc.pk,
+            'predicted': False,
+            'localised': True,
+            **_get_iteration_counts(calc),
+        })
+        self.ctx.trace_distances[str(calc.pk)] = distance
+        optimize_distance = self.ctx.optimize_distance
+        if optimize_distance is not None and optimize_distance.value <= distance.value:
+            self.report('the localised scan point is not better than the optimal Wannierization, keeping the latter')
+            self.ctx.best_calc = None
+            self.ctx.best_bands_distance = optimize_distance
+            return
+        self.ctx.best_calc = calc
+        self.ctx.best_bands_distance = distance
+
+    def should_run_plot(self):
+        kwargs = self.inputs.kwargs if 'kwargs' in self.inputs else {}
+        return self.ctx.best_calc is not None and kwargs.get('plot_wannier_functions', False)
+
+    def run_plot(self):
+        """Plot the Wannier functions of the best scan point, restarting from its checkpoint"""
+        best = self.ctx.best_calc
+        builder = best.get_builder_restart()
+        parameters = builder.parameters.get_dict()
+        parameters.update({'restart': 'plot', 'wannier_plot': True, 'bands_plot': False})
+        builder.parameters = orm.Dict(parameters)
+        builder.metadata.options.additional_retrieve_list = [
+            *builder.metadata.options.get('additional_retrieve_list', []), '*.xsf'
+        ]
+        builder.remote_input_folder = best.outputs.remote_folder
+        builder.metadata.call_link_label = 'wannier90_plot'
+        node = self.submit(builder)
+        self.report(f'submitting `Wannier90Calculation` <PK={node.pk}>')
+        self.to_context(wannier90_plot=node)
+
+    def results_optimize(self):
+        """Attach the bands results, replacing the optimal Wannierization by the best scan point if any"""
+        workchain = self.ctx['wannier90_bands']
+        outputs = self.exposed_outputs(workchain, Wannier90OptimizeWorkChain, namespace='wannier90_bands')
+        optimal = self.ctx.optimize_calc
+        plot = None
+        if 'wannier90_plot' in workchain.outputs:
+            plot = workchain.outputs.wannier90_plot.output_parameters.creator
+        best = self.ctx.best_calc
+        if best is None:
+            # e.g. no scan point was successful, with ``scan_warm_start``
+            self.ctx.best_bands_distance = self.ctx.optimize_distance
+        else:
+            self.report(f'the best Wannierization is the scan point <PK={best.pk}>')
+            optimal = best
+            plot = self.ctx.get('wannier90_plot')
+            if plot is not None and not plot.is_finished_ok:
+                self.report(f'the plotting calculation <PK={plot.pk}> failed')
+                plot = None
+        # the optimize workchain runs without the reference bands, so it does not output these
+        outputs['wannier90_bands.wannier90_optimal'] = _get_calculation_outputs(optimal)
+        if self.ctx.best_bands_distance is not None:
+            outputs['wannier90_bands.bands_distance'] = self.ctx.best_bands_distance
+        if 'interpolated_bands' in optimal.outputs:
+            outputs['wannier90_bands.band_structure'] = optimal.outputs.interpolated_bands
+        if best is not None:
+            if plot is not None:
+                outputs['wannier90_bands.wannier90_plot'] = _get_calculation_outputs(plot)
+            else:
+                outputs.pop('wannier90_bands.wannier90_plot', None)
+        self.ctx.optimal_calc = optimal
+        self.ctx.plot_calc = plot
+        self.out_many(outputs)
+        if self.ctx.scan_mode is not None:
+            self.out('optimize_trace', self._build_trace())
+
+    def _build_trace(self):
+        """Return the trace of the scan, created by a calcfunction from the calculations of its points"""
+        inputs = {}
+        for index, point in enumerate(self.ctx.trace):
+            calc = orm.load_node(point['pk'])
+            inputs[f'parameters_{index}'] = calc.inputs.parameters
+            inputs[f'info_{index}'] = orm.Dict({
+                key: value for key, value in point.items()
+                if key not in ('dis_proj_max', 'dis_proj_min', 'bands_distance')
+            })
+            if str(point['pk']) in self.ctx.trace_distances:
+                inputs[f'bands_distance_{index}'] = self.ctx.trace_distances[str(point['pk'])]
+        return build_optimize_trace(**inputs, metadata={'call_link_label': 'optimize_trace'})
+
+    def should_generate_isosurface(self):
+        kwargs = self.inputs.kwargs if 'kwargs' in self.inputs else {}
+        return kwargs.get('plot_wannier_functions', False) and kwargs.get('generate_isosurface', False)
+
+    def run_generate_isosurface(self):
+        """Precompute the isosurfaces of the Wannier functions, so that the results panel only loads them"""
+        retrieved = (self.ctx.plot_calc or self.ctx.optimal_calc).outputs.retrieved
+        meshes = compute_isosurfaces(retrieved, orm.List(list=ISOSURFACE_ISOVALUE_SCALES))
+        for key, mesh in meshes.items():
+            self.out(f'generate_isosurface.{key}', mesh)
+        self.report(f'Generated isosurfaces for {len(meshes)} Wannier functions')
 
     def should_run_skeaf(self):
         kwargs = self.inputs.kwargs if 'kwargs' in self.inputs else {}
@@ -219,11 +785,7 @@ class QeAppWannier90BandsWorkChain(WorkChain):
         else:
             overrides = {}
         kwargs = self.inputs.kwargs if 'kwargs' in self.inputs else {}
-        wannier_node = self.ctx.wannier90_bands
-        try:
-            wannier_calc = wannier_node.outputs.wannier90_plot.output_parameters.creator
-        except AttributeError:
-            wannier_calc =  wannier_node.outputs.wannier90_optimal.output_parameters.creator
+        wannier_calc = self.ctx.plot_calc or self.ctx.optimal_calc
         parent_folder = wannier_calc.outputs.remote_folder
         pseudos = self.inputs.overrides.pw_bands['scf']['pw']['pseudos']
         structure = wannier_calc.inputs.structure
@@ -17,6 +17,7 @@ def get_builder(codes, structure, parameters, **kwargs):
     wannier90_parameters = deepcopy(parameters['wannier90'])
     exclude_semicore=wannier90_parameters.pop('exclude_semicore')
     plot_wannier_functions=wannier90_parameters.pop('plot_wannier_functions')
+    generate_isosurface=wannier90_parameters.pop('generate_isosurface', False)
     retrieve_hamiltonian=wannier90_parameters.pop('retrieve_hamiltonian')
     retrieve_matrices=wannier90_parameters.pop('retrieve_matrices')
     projection_type=wannier90_parameters.pop('projection_type')
@@ -70,6 +71,7 @@ def get_builder(codes, structure, parameters, **kwargs):
         parallelization=parallelization,
         exclude_semicore=exclude_semicore,
         plot_wannier_functions=plot_wannier_functions,
+        generate_isosurface=generate_isosurface,
         electronic_type=ElectronicType(parameters['workchain']['electronic_type']),
         spin_type=SpinType(parameters['workchain']['spin_type']),
         initial_magnetic_moments=parameters['advanced']['initial_magnetic_moments'],
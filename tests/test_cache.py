@@ -0,0 +1,56 @@
+"""Tests for the in-memory caches."""
+
+import numpy as np
+
+from aiidalab_qe_wannier90.cache import LRUCache, get_nbytes
+
+
+def _array(nbytes):
+    return np.zeros(nbytes // 8)
+
+
+def test_get_nbytes():
+    assert get_nbytes({'a': _array(80), 'b': [_array(16), (_array(8), 'text')]}) == 104
+    assert get_nbytes('text') == 0
+
+
+def test_lru_cache_eviction():
+    """The least recently used values are evicted once the budget is exceeded."""
+    cache = LRUCache(max_bytes=240)
+    for key in 'abc':
+        cache.put(key, _array(80))
+    assert cache.nbytes == 240
+    # reading 'a' makes 'b' the least recently used value
+    assert cache.get('a') is not None
+    cache.put('d', _array(80))
+    assert 'b' not in cache
+    assert [key for key in 'acd' if key in cache] == ['a', 'c', 'd']
+    assert cache.nbytes == 240
+    # a larger value evicts as many values as needed
+    cache.put('e', _array(160))
+    assert [key for key in 'acde' if key in cache] == ['d', 'e']
+    assert cache.nbytes == 240
+
+
+def test_lru_cache_replace_and_oversized():
+    cache = LRUCache(max_bytes=100)
+    cache.put('a', _array(40))
+    cache.put('a', _array(80))
+    assert len(cache) == 1
+    assert cache.nbytes == 80
+    # a value larger than the whole budget is not cached, and replaces the previous one
+    cache.put('a', _array(200))
+    assert 'a' not in cache
+    assert cache.nbytes == 0
+    assert cache.get('a', 'missing') == 'missing'
+
+
+def test_lru_cache_pop_and_clear():
+    cache = LRUCache(max_bytes=100)
+    cache.put('a', _array(40))
+    cache.put('b', _array(40))
+    assert cache.pop('a') is not None
+    assert cache.nbytes == 40
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.nbytes == 0
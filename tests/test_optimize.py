@@ -0,0 +1,103 @@
+"""Tests for the search and the prediction of the disentanglement thresholds."""
+
+import numpy as np
+import pytest
+
+from aiidalab_qe_wannier90.optimize import (
+    DEFAULT_DISPROJ_MAX,
+    DISPROJ_MAX_RANGE,
+    DISPROJ_MIN_RANGE,
+    predict_disproj,
+    propose_disproj_points,
+)
+
+
+def _point(disproj_max, disproj_min, bands_distance):
+    return {'dis_proj_max': disproj_max, 'dis_proj_min': disproj_min, 'bands_distance': bands_distance}
+
+
+def test_propose_disproj_points_neighbours():
+    """The neighbours of the best point are proposed, within the ranges."""
+    trace = [_point(0.95, 0.05, 0.02), _point(0.90, 0.05, 0.01)]
+    points, step_max, step_min = propose_disproj_points(trace, 0.04, 0.04)
+    assert (step_max, step_min) == (0.04, 0.04)
+    assert sorted(points) == sorted([(0.86, 0.05), (0.94, 0.05), (0.9, 0.01), (0.9, 0.09)])
+
+
+def test_propose_disproj_points_clip_and_skip_evaluated():
+    trace = [_point(0.99, 0.01, 0.01), _point(0.95, 0.01, 0.02)]
+    points, _, _ = propose_disproj_points(trace, 0.04, 0.04)
+    # the neighbours outside the ranges are clipped onto the best point, which was evaluated
+    assert points == [(0.99, 0.05)]
+
+
+def test_propose_disproj_points_refine():
+    """Once all the neighbours are evaluated without improvement, the steps are halved."""
+    trace = [
+        _point(0.9, 0.05, 0.01),
+        _point(0.86, 0.05, 0.02),
+        _point(0.94, 0.05, 0.02),
+        _point(0.9, 0.01, 0.02),
+        _point(0.9, 0.09, 0.02),
+    ]
+    points, step_max, step_min = propose_disproj_points(trace, 0.04, 0.04)
+    assert (step_max, step_min) == (0.02, 0.02)
+    assert sorted(points) == sorted([(0.88, 0.05), (0.92, 0.05), (0.9, 0.03), (0.9, 0.07)])
+
+
+def test_propose_disproj_points_converged():
+    trace = [_point(0.9, 0.05, 0.01)]
+    assert propose_disproj_points(trace, 0.004, 0.004)[0] == []
+
+
+def test_propose_disproj_points_without_success():
+    """Without a successful point, the search starts from the first point of the exhaustive scan, once."""
+    start = (DISPROJ_MAX_RANGE[0], DISPROJ_MIN_RANGE[0])
+    trace = [_point(None, None, 0.01), _point(0.9, 0.05, None)]
+    assert propose_disproj_points(trace, 0.04, 0.04)[0] == [start]
+    assert propose_disproj_points(trace + [_point(*start, None)], 0.04, 0.04)[0] == []
+
+
+def test_propose_disproj_points_pending():
+    """The points being evaluated are not proposed again, and the steps are not halved while waiting for them."""
+    trace = [_point(0.9, 0.05, 0.01)]
+    neighbours = [(0.86, 0.05), (0.94, 0.05), (0.9, 0.01), (0.9, 0.09)]
+    points, _, _ = propose_disproj_points(trace, 0.04, 0.04, pending=neighbours[:1])
+    assert sorted(points) == sorted(neighbours[1:])
+    assert propose_disproj_points(trace, 0.04, 0.04, pending=neighbours) == ([], 0.04, 0.04)
+
+
+@pytest.mark.parametrize('max_points, expected', [(None, 4), (2, 2), (0, 0), (-1, 0)])
+def test_propose_disproj_points_max_points(max_points, expected):
+    """Once the trace is longer than the budget, no point is proposed."""
+    trace = [_point(0.9, 0.05, 0.01), _point(0.95, 0.05, 0.02)]
+    points, _, _ = propose_disproj_points(trace, 0.02, 0.02, max_points=max_points)
+    assert len(points) == expected
+
+
+def test_predict_disproj():
+    """The thresholds are put in the gaps of the projectabilities, and the frozen window below the first
+    state above the Fermi energy that is not frozen by projectability."""
+    rng = np.random.default_rng(0)
+    # well-projected states up to 1 eV above the Fermi energy, then a poorly projected band
+    energies = np.concatenate([np.linspace(-5, 1, 300), np.linspace(1.2, 1.8, 100), np.linspace(3, 4, 50)])
+    projectabilities = np.concatenate([
+        rng.uniform(0.97, 1.0, 300), rng.uniform(0.3, 0.6, 100), rng.uniform(0.0, 0.05, 50)
+    ])
+    prediction = predict_disproj(energies, projectabilities, fermi_energy=0.0)
+    assert 0.85 <= prediction['dis_proj_max'] <= 0.95
+    assert DISPROJ_MIN_RANGE[0] <= prediction['dis_proj_min'] <= DISPROJ_MIN_RANGE[1]
+    # the states above the window are ignored, the others are all above dis_proj_min
+    assert not np.any((projectabilities[:400] > prediction['dis_proj_min'] - 0.02) &
+                      (projectabilities[:400] < prediction['dis_proj_min'] + 0.02))
+    assert prediction['dis_froz_max'] == pytest.approx(1.2 - 0.01)
+
+
+def test_predict_disproj_defaults():
+    """Without gaps in the distribution, the thresholds closest to the recommended ones are preferred."""
+    energies = np.linspace(-5, 0, 200)
+    prediction = predict_disproj(energies, np.ones_like(energies), fermi_energy=0.0)
+    assert prediction['dis_proj_max'] == pytest.approx(DEFAULT_DISPROJ_MAX)
+    assert prediction['dis_proj_min'] == pytest.approx(DISPROJ_MIN_RANGE[0])
+    # no state above the Fermi energy in the window: the frozen window extends to its end
+    assert prediction['dis_froz_max'] == pytest.approx(2.0 - 0.01)
@@ -0,0 +1,149 @@
+"""Tests for the tight-binding models and the density of states."""
+
+import io
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from aiidalab_qe_wannier90.tight_binding import (
+    TETRAHEDRON_WORK_ARRAYS,
+    _slab_tetrahedra,
+    _tetrahedron_chunks,
+    _tetrahedron_counts,
+    compute_dos,
+    eigenvalues,
+    monkhorst_pack_plane,
+    parse_tb_dat,
+)
+
+# chunk sizes that cut the file inside numbers and line endings
+CHUNK_SIZES = [1, 7, 64, 4 * 1024**2]
+
+
+def _write_tb_dat(num_wann=2):
+    """Return the text of a ``_tb.dat`` file and the matrices it contains."""
+    rng = np.random.default_rng(1)
+    irvec = np.array([[0, 0, 0], [1, 0, 0], [-1, 0, 0], [0, 1, -1]])
+    ndegen = np.array([1, 2, 2, 4])
+    hamiltonian = rng.normal(size=(4, num_wann, num_wann)) + 1j * rng.normal(size=(4, num_wann, num_wann))
+    position = rng.normal(size=(4, 3, num_wann, num_wann)) + 1j * rng.normal(size=(4, 3, num_wann, num_wann))
+    lattice = np.array([[0.0, 2.5, 2.5], [2.5, 0.0, 2.5], [2.5, 2.5, 0.0]])
+    lines = [' written on 18Oct2026 at 12:00:00 ']
+    lines += [''.join(f'{x:22.16f}' for x in vector) for vector in lattice]
+    lines += [f'{num_wann:12d}', f'{len(irvec):12d}', ''.join(f'{d:5d}' for d in ndegen)]
+    for vector, matrix in zip(irvec, hamiltonian):
+        lines += ['', ''.join(f'{x:5d}' for x in vector)]
+        lines += [
+            f'{m + 1:5d}{n + 1:5d}   {matrix[m, n].real:15.8E} {matrix[m, n].imag:15.8E}'
+            for n in range(num_wann) for m in range(num_wann)
+        ]
+    for vector, matrices in zip(irvec, position):
+        lines += ['', ''.join(f'{x:5d}' for x in vector)]
+        lines += [
+            f'{m + 1:5d}{n + 1:5d}   ' + ' '.join(f'{x.real:15.8E} {x.imag:15.8E}' for x in matrices[:, m, n])
+            for n in range(num_wann) for m in range(num_wann)
+        ]
+    model = {'lattice': lattice, 'irvec': irvec, 'ndegen': ndegen, 'hamiltonian': hamiltonian, 'position': position}
+    return '\n'.join(lines) + '\n', model
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_parse_tb_dat(chunk_size):
+    text, expected = _write_tb_dat()
+    model = parse_tb_dat(io.StringIO(text), chunk_size=chunk_size)
+    np.testing.assert_allclose(model['lattice'], expected['lattice'])
+    np.testing.assert_array_equal(model['irvec'], expected['irvec'])
+    np.testing.assert_array_equal(model['ndegen'], expected['ndegen'])
+    np.testing.assert_allclose(model['hamiltonian'], expected['hamiltonian'], rtol=1e-7)
+    np.testing.assert_allclose(model['position'], expected['position'], rtol=1e-7)
+
+
+def test_parse_tb_dat_truncated():
+    text, _ = _write_tb_dat()
+    with pytest.raises(ValueError, match='Unexpected end of file'):
+        parse_tb_dat(io.StringIO(text[:text.rfind('\n', 0, len(text) // 2) + 1]), chunk_size=7)
+
+
+@pytest.fixture
+def cubic_model():
+    """Return the nearest-neighbour single-band model of a simple cubic lattice, E(k) = -2 Σ_i cos(2π k_i)."""
+    irvec = np.array([[0, 0, 0], [1, 0, 0], [-1, 0, 0], [0, 1, 0], [0, -1, 0], [0, 0, 1], [0, 0, -1]])
+    hamiltonian = np.zeros((len(irvec), 1, 1), dtype=np.complex128)
+    hamiltonian[1:] = -1
+    return {
+        'lattice': np.eye(3),
+        'irvec': irvec,
+        'ndegen': np.ones(len(irvec), dtype=int),
+        'hamiltonian': hamiltonian,
+        'position': np.zeros((len(irvec), 3, 1, 1), dtype=np.complex128),
+    }
+
+
+def _slab(model, mesh):
+    planes = [eigenvalues(model, monkhorst_pack_plane(mesh, index)).reshape(*mesh[1:], -1) for index in (0, 1)]
+    return _slab_tetrahedra(*planes)
+
+
+@pytest.mark.parametrize('max_bytes', [1, 64 * 1024, 1024**2])
+def test_tetrahedron_chunks(cubic_model, max_bytes):
+    """The chunks cover all the tetrahedra, and their work arrays fit in the budget."""
+    energies = np.linspace(-6.5, 6.5, 2001)
+    corners = _slab(cubic_model, (16, 16, 16))
+    chunks = _tetrahedron_chunks(corners, energies, max_bytes)
+    assert chunks[0].start == 0
+    assert chunks[-1].stop == len(corners)
+    assert all(previous.stop == chunk.start for previous, chunk in zip(chunks, chunks[1:]))
+    for chunk in chunks:
+        if chunk.stop - chunk.start == 1:
+            continue
+        spans = np.searchsorted(energies, corners[chunk, 3]) - np.searchsorted(energies, corners[chunk, 0])
+        assert np.sum(spans + 1) * TETRAHEDRON_WORK_ARRAYS * 8 <= max_bytes
+
+
+def test_tetrahedron_counts_memory(cubic_model):
+    """The memory allocated by a chunk of tetrahedra stays within the budget."""
+    max_bytes = 1024**2
+    energies = np.linspace(-6.5, 6.5, 4001)
+    corners = _slab(cubic_model, (24, 24, 24))
+    counts = np.zeros(len(energies))
+    tracemalloc.start()
+    try:
+        for chunk in _tetrahedron_chunks(corners, energies, max_bytes):
+            tracemalloc.reset_peak()
+            start, _ = tracemalloc.get_traced_memory()
+            counts += _tetrahedron_counts(corners[chunk], energies)
+            _, peak = tracemalloc.get_traced_memory()
+            # the arrays over the energy grid do not depend on the chunk
+            assert peak - start <= max_bytes + 4 * energies.nbytes
+    finally:
+        tracemalloc.stop()
+    np.testing.assert_allclose(counts, _tetrahedron_counts(corners, energies))
+
+
+def test_compute_dos_flat_band(cubic_model):
+    """A dispersionless band holds two states per cell exactly at its energy."""
+    cubic_model['hamiltonian'][1:] = 0
+    cubic_model['hamiltonian'][0] = 0.5
+    dos = compute_dos(cubic_model, (4, 4, 4), energies=np.linspace(-1, 2, 301))
+    for method in ('tetrahedron', 'gaussian'):
+        integrated = dos[method]['integrated']
+        np.testing.assert_allclose(integrated[dos['energies'] < 0.2], 0, atol=1e-8)
+        np.testing.assert_allclose(integrated[dos['energies'] > 0.8], 2, atol=1e-8)
+
+
+def test_compute_dos_cubic(cubic_model):
+    """The band of the cubic model spans [-6, 6] eV, is symmetric about 0 and has a van Hove singularity at ±2 eV."""
+    energies = np.linspace(-7, 7, 1401)
+    dos = compute_dos(cubic_model, (24, 24, 24), energies=energies, max_bytes=1024**2, max_workers=2)
+    integrated = dos['tetrahedron']['integrated']
+    np.testing.assert_allclose(integrated[energies < -6], 0, atol=1e-8)
+    np.testing.assert_allclose(integrated[energies > 6], 2, atol=1e-8)
+    # half filling at the centre of the band, and N(-E) = 2 - N(E)
+    assert np.interp(0, energies, integrated) == pytest.approx(1, abs=1e-3)
+    np.testing.assert_allclose(integrated + integrated[::-1], 2, atol=2e-3)
+    # the density of states is symmetric, and both methods count the same states
+    tetrahedron = dos['tetrahedron']['dos']
+    np.testing.assert_allclose(tetrahedron, tetrahedron[::-1], atol=5e-3)
+    assert np.sum(tetrahedron) * (energies[1] - energies[0]) == pytest.approx(2, abs=1e-2)
+    np.testing.assert_allclose(dos['gaussian']['integrated'], integrated, atol=0.02)
@@ -0,0 +1,41 @@
+"""Tests for the streaming parser of the ``.wout`` files."""
+
+import io
+
+import numpy as np
+import pytest
+
+from aiidalab_qe_wannier90.utils import parse_wout
+
+# chunk sizes that cut the file inside numbers, keywords and line endings
+CHUNK_SIZES = [1, 7, 64, 4 * 1024**2]
+
+
+def _write_wout(num_dis=12, num_iter=5, num_wann=3):
+    """Return the text of a ``.wout`` file, with the spreads and centres of the iteration ``i`` depending on ``i``."""
+    lines = [' +--------------------------------------------------------------------+<-- DIS']
+    lines += [
+        f'      {i:4d}      {20 - i * 0.01:.8f}      {20 - i * 0.011:.8f}       1.003E-01      0.00    <-- DIS'
+        for i in range(1, num_dis + 1)
+    ]
+    lines += [' *------------------------------- WANNIERISE ---------------------------------*']
+    for step in range(num_iter + 1):
+        lines += [f' Cycle: {step:6d}']
+        lines += [
+            f'  WF centre and spread    {w}  ( {0.1 * w:10.6f}, {-0.2 * w:10.6f}, {step:10.6f} )'
+            f'    {w + 0.01 * step:12.8f}'
+            for w in range(1, num_wann + 1)
+        ]
+        lines += [f'        O_D=      0.0102139 O_OD=      0.2386543 O_TOT=     {18.5 - 0.01 * step:.7f} <-- SPRD']
+    lines += [' Final State']
+    return '\n'.join(lines) + '\n'
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_parse_wout(chunk_size):
+    series = parse_wout(io.StringIO(_write_wout()), chunk_size=chunk_size)
+    np.testing.assert_allclose(series['omega_i'], 20 - np.arange(1, 13) * 0.011)
+    np.testing.assert_allclose(series['omega_tot'], 18.5 - np.arange(6) * 0.01)
+    assert series['centres'].shape == (6, 3, 3)
+    np.testing.assert_allclose(series['centres'][:, 1], [[0.2, -0.4, step] for step in range(6)])
+    np.testing.assert_allclose(series['spreads'][:, 2], 3 + 0.01 * np.arange(6))
@@ -0,0 +1,61 @@
+"""Tests for the parser of the XSF datagrids."""
+
+import io
+
+import numpy as np
+import pytest
+
+from aiidalab_qe_wannier90.utils import parse_xsf
+
+# chunk sizes that cut the file inside numbers, keywords and line endings
+CHUNK_SIZES = [1, 7, 64, 4 * 1024**2]
+
+CELL = np.diag([4.0, 5.0, 6.0])
+
+
+def _write_xsf(grids, origin=(0.5, 0.0, -0.5)):
+    """Return the text of an XSF file with one datagrid per item of ``grids``."""
+    lines = ['# written by the tests', '', 'CRYSTAL', 'PRIMVEC']
+    lines += [' '.join(f'{x:.6f}' for x in vector) for vector in CELL]
+    lines += ['PRIMCOORD', ' 2 1', ' H 0.0 0.0 0.0', ' O 1.0 1.0 1.0', '', 'BEGIN_BLOCK_DATAGRID_3D', '3D_field']
+    for index, data in enumerate(grids):
+        lines += [f'BEGIN_DATAGRID_3D_WF{index}', ' '.join(str(n) for n in data.shape)]
+        lines += [' '.join(f'{x:.6f}' for x in origin)]
+        lines += [' '.join(f'{x:.6f}' for x in vector) for vector in CELL]
+        # the x index runs fastest, six values per line
+        values = data.ravel(order='F')
+        lines += [' '.join(f'{x:.8e}' for x in values[i:i + 6]) for i in range(0, len(values), 6)]
+        lines += ['END_DATAGRID_3D']
+    lines += ['END_BLOCK_DATAGRID_3D']
+    return '\n'.join(lines) + '\n'
+
+
+@pytest.fixture
+def grid():
+    return np.random.default_rng(0).normal(size=(5, 4, 3))
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_parse_xsf(grid, chunk_size):
+    text = _write_xsf([grid, 2 * grid])
+    atoms, grids = parse_xsf(io.StringIO(text), chunk_size=chunk_size)
+    assert atoms.get_chemical_symbols() == ['H', 'O']
+    assert [item['name'] for item in grids] == ['WF0', 'WF1']
+    for item, expected in zip(grids, (grid, 2 * grid)):
+        assert item['shape'] == grid.shape
+        np.testing.assert_allclose(item['origin'], [0.5, 0.0, -0.5])
+        np.testing.assert_allclose(item['lattice_vectors'], CELL)
+        np.testing.assert_allclose(item['data'], expected, rtol=1e-7)
+
+
+@pytest.mark.parametrize('chunk_size', CHUNK_SIZES)
+def test_parse_xsf_periodic_stride(grid, chunk_size):
+    """The periodic duplicate edge is dropped and the grid downsampled while it is read."""
+    _, grids = parse_xsf(io.StringIO(_write_xsf([grid])), periodic=True, stride=2, chunk_size=chunk_size)
+    np.testing.assert_allclose(grids[0]['data'], grid[:-1:2, :-1:2, :-1:2], rtol=1e-7)
+
+
+def test_parse_xsf_truncated(grid):
+    text = _write_xsf([grid]).replace(f'{grid.ravel(order="F")[-1]:.8e}', '')
+    with pytest.raises(ValueError, match='Mismatch in density data size'):
+        parse_xsf(io.StringIO(text), chunk_size=7)